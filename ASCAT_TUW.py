@@ -5,25 +5,34 @@ import os
 import h5py
 import netCDF4
 from datetime import datetime, timedelta
+import calendar
+from functools import partial
+from tqdm import tqdm
+
+from HydroAI.Parallel_IO import prefetch_map, read_nc_variable, decode_nc_values, NC_LOCK
 
 def convert_to_local_time(df):
     # Function to convert fraction of days since 1900-01-01 00:00:00 UTC to local time
-    # Calculate UTC time
-    base_date = datetime(1900, 1, 1, 0, 0, 0)
-    utc_time = base_date + pd.to_timedelta(df['time'], unit='D')
-
-    # Calculate timezone offset based on longitude
-    timezone_offset_hours = df['lon'] / 15  # 15 degrees per hour
-    timezone_offset = pd.to_timedelta(timezone_offset_hours, unit='H')
+    # The timezone offset based on longitude is lon / 15 hours (15 degrees per hour), i.e., lon / 360 days
+    return local_solar_time(df['time'], df['lon'])
 
-    # Convert to local time
-    local_time = utc_time + timezone_offset
+def local_solar_time(time, lon):
+    """
+    Local solar time in fractional days since 1900-01-01 00:00:00, from UTC time in the same unit (vectorized).
+    """
+    return time + lon / 360
 
-    # Convert local time back to fraction of days since 1900-01-01 00:00:00
-    local_time_fraction_days = (local_time - base_date) / timedelta(days=1)
+def local_datetime64(time, lon, unit='s'):
+    """
+    Local solar time as np.datetime64 (UTC time in fractional days since 1900-01-01 00:00:00), NaT for NaN times.
+    """
+    local_time = np.asarray(local_solar_time(np.asarray(time, dtype=np.float64), np.asarray(lon, dtype=np.float64)))
+    missing = np.isnan(local_time)
+    # Truncated to the unit (with a tolerance for the float representation of exact times)
+    n_units = np.floor(np.where(missing, 0, local_time) * (np.timedelta64(1, 'D') / np.timedelta64(1, unit)) + 1e-6)
+    local_time = np.datetime64('1900-01-01', unit) + n_units.astype(np.int64).astype(f'timedelta64[{unit}]')
+    return np.where(missing, np.datetime64('NaT', unit), local_time)
 
-    return local_time_fraction_days
-    
 def calculate_doy(dt, base_year):
     year_start = datetime(base_year, 1, 1)
     doy = (dt - year_start).days + 1
@@ -58,6 +67,137 @@ def load_porosity_mat(mat_file):
         variables[var_name] = data[var_name]
     return variables
 
+def read_cell_file(nc_file, obs_vars=('time', 'sm', 'conf_flag', 'dir')):
+    """
+    Read a TU Wien ASCAT cell file (contiguous ragged array) and expand the location variables to observations.
+
+    Args:
+        nc_file (str): Path of the cell file.
+        obs_vars (list): Observation variables to read.
+
+    Returns:
+        dict: 1D arrays (one entry per observation) of obs_vars and 'lon', 'lat', 'location_id', with NaN for
+            fill values.
+    """
+    with NC_LOCK:
+        with netCDF4.Dataset(nc_file) as nc_data:
+            raw = {name: read_nc_variable(nc_data.variables[name])
+                   for name in ('row_size', 'lon', 'lat', 'location_id') + tuple(obs_vars)}
+
+    row_size = decode_nc_values(*raw['row_size'])
+    valid_rows = ~np.isnan(row_size)
+    row_size = row_size[valid_rows].astype(np.int64)
+
+    obs = {}
+    for name in ('lon', 'lat', 'location_id'):
+        obs[name] = np.repeat(decode_nc_values(*raw[name])[valid_rows], row_size)
+    for name in obs_vars:
+        obs[name] = decode_nc_values(*raw[name])[:row_size.sum()]
+    return obs
+
+def grid_indices(lon, lat, target_lon, target_lat):
+    """
+    Direct index computation of the target grid cells of points, for rectilinear grids (e.g., regular lat/lon
+    or EASE2), whose longitude depends only on the column and latitude only on the row.
+
+    Args:
+        lon, lat (np.array): 1D point coordinates.
+        target_lon, target_lat (np.array): 2D grid coordinates (cell centers).
+
+    Returns:
+        tuple: rows, cols and a mask of the points within the grid (half a cell beyond the outer centers).
+    """
+    def axis_index(values, centers):
+        ascending = centers[-1] > centers[0]
+        c = centers if ascending else centers[::-1]
+        edges = np.concatenate(([1.5 * c[0] - 0.5 * c[1]], (c[1:] + c[:-1]) / 2, [1.5 * c[-1] - 0.5 * c[-2]]))
+        index = np.searchsorted(edges, values, side='right') - 1
+        inside = (index >= 0) & (index < len(c))
+        index = np.clip(index, 0, len(c) - 1)
+        return (index if ascending else len(c) - 1 - index), inside
+
+    cols, inside_cols = axis_index(lon, target_lon[0, :])
+    rows, inside_rows = axis_index(lat, target_lat[:, 0])
+    return rows, cols, inside_cols & inside_rows
+
+def accumulate_daily(sums, sums_sq, counts, rows, cols, doys, values):
+    """
+    Add observations to per-cell daily sums, sums of squares and counts (lat, lon, doy) in place, with bincount
+    over the occupied (row, col, doy) bins only.
+    """
+    flat = np.ravel_multi_index((rows, cols, doys), sums.shape)
+    unique_flat, inverse = np.unique(flat, return_inverse=True)
+    sums.ravel()[unique_flat] += np.bincount(inverse, weights=values)
+    sums_sq.ravel()[unique_flat] += np.bincount(inverse, weights=values * values)
+    counts.ravel()[unique_flat] += np.bincount(inverse).astype(counts.dtype)
+
+def grid_cell_file(nc_file, year, target_lon, target_lat, variable_name='sm', local_time=True, mask_func=None):
+    """
+    Read a cell file and return the grid bins (rows, cols, doys) and values of the valid observations in year.
+    """
+    obs = read_cell_file(nc_file, ('time', variable_name) + (('dir', 'conf_flag') if mask_func is not None else ()))
+
+    time = local_datetime64(obs['time'], obs['lon'] if local_time else 0)
+    # Day of the year of the (local) date; NaT times fail both bounds
+    doys = (time.astype('datetime64[D]') - np.datetime64(f'{year}-01-01', 'D')).astype(np.int64) + 1
+
+    doy_max = 366 if calendar.isleap(year) else 365
+    rows, cols, inside = grid_indices(obs['lon'], obs['lat'], target_lon, target_lat)
+    keep = inside & (doys >= 1) & (doys <= doy_max) & ~np.isnan(obs[variable_name])
+    if mask_func is not None:
+        keep &= mask_func(obs)
+
+    return rows[keep], cols[keep], doys[keep].astype(np.int64), obs[variable_name][keep]
+
+def create_array_from_cells(file_list, year, target_lon, target_lat, variable_name='sm', local_time=True,
+                            mask_func=None, store=None, n_workers=4, prefetch=8, executor='process'):
+    """
+    Native ASCAT swath-to-grid pipeline: cell files are read and binned to the target grid in parallel workers,
+    and the per-cell daily statistics are accumulated with bincount into (lat, lon, doy_max + 1) arrays.
+    Replaces the .mat/.csv intermediates (load_mat_file) of the previous workflow.
+
+    Args:
+        file_list (list): TU Wien ASCAT cell files (.nc).
+        year (int): Year of the output.
+        target_lon, target_lat (np.array): 2D coordinates of the rectilinear target grid (see grid_indices).
+        variable_name (str): Observation variable (e.g., 'sm').
+        local_time (bool): Assign observations to the day of their local solar time (see local_datetime64).
+        mask_func (callable): Optional function of the observation dict (read_cell_file output with 'dir' and
+            'conf_flag') returning the observations to keep, e.g., (obs['dir'] == 0) & (obs['conf_flag'] == 0).
+            It has to be a module-level function with the 'process' executor.
+        store (Datacube.DataCubeStore): Optional chunked store the yearly mean is written into (write_year).
+        n_workers, prefetch, executor: Reading pool (see Parallel_IO.prefetch_map).
+
+    Returns:
+        tuple: Daily mean and standard deviation (lat, lon, doy_max + 1) with NaN where there is no observation,
+            and the daily counts.
+    """
+    doy_max = 366 if calendar.isleap(year) else 365
+    shape = target_lat.shape + (doy_max + 1,)
+    sums = np.zeros(shape)
+    sums_sq = np.zeros(shape)
+    counts = np.zeros(shape, dtype=np.int32)
+
+    grid_file = partial(grid_cell_file, year=year, target_lon=target_lon, target_lat=target_lat,
+                        variable_name=variable_name, local_time=local_time, mask_func=mask_func)
+    results = prefetch_map(grid_file, file_list, n_workers=n_workers, prefetch=prefetch, executor=executor)
+    for i, binned, error in tqdm(results, total=len(file_list), desc="Processing files", unit="file"):
+        if error is not None:
+            if not isinstance(error, OSError):
+                raise error
+            print(f"Error processing file {file_list[i]}: {error}")
+            continue
+        accumulate_daily(sums, sums_sq, counts, *binned)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        data_array = np.where(counts > 0, sums / counts, np.nan)
+        std_array = np.sqrt(np.maximum(np.where(counts > 0, sums_sq / counts, np.nan) - data_array ** 2, 0))
+
+    if store is not None:
+        store.write_year(data_array, year)
+
+    return data_array, std_array, counts
+
 def create_netcdf_file(nc_file, latitude, longitude, VAR, var_name='ASCAT_SM'):
     # Create a new NetCDF file
     nc_data = netCDF4.Dataset(nc_file, 'w')
@@ -0,0 +1,164 @@
+"""
+Climatology.py: A module for multi-year day-of-year (DOY) climatologies and anomalies of daily data cubes.
+
+The readers (e.g., SMAP.create_array_from_h5, AMSR2_LPRM.create_array_from_nc) produce yearly cubes of shape
+(lat, lon, doy_max + 1), where index 0 of the time axis is unused and index doy holds day-of-year doy.
+DOYClimatology accumulates per-pixel sums and counts for every DOY, one yearly cube (or NetCDF file) at a time,
+so the full record never has to be loaded. The +-k day window is applied (circularly) only when the
+climatology is requested.
+
+Example:
+clim = DOYClimatology(window=15)
+for year in range(2016, 2023):
+    clim.add_file(f'SMAP_{year}.nc', 'soil_moisture')
+clim.save('SMAP_clim.npz')
+anomaly = clim.anomaly(data_array)
+"""
+import numpy as np
+import netCDF4
+from tqdm import tqdm
+
+from HydroAI.Parallel_IO import read_nc_variable, decode_nc_values
+
+class DOYClimatology:
+    n_doy = 367  # index 0 unused, 1..366
+
+    def __init__(self, window=15, min_count=1):
+        """
+        Parameters:
+        - window: Half width k of the +-k day moving window
+        - min_count: Minimum number of valid samples in the window for a climatology value
+        """
+        self.window = window
+        self.min_count = min_count
+        self.sums = None
+        self.counts = None
+        self.n_years = 0
+        self._climatology = None
+
+    def _allocate(self, shape):
+        if self.sums is None:
+            self.sums = np.zeros((shape[0], shape[1], self.n_doy))
+            self.counts = np.zeros((shape[0], shape[1], self.n_doy), dtype=np.int32)
+        elif self.sums.shape[:2] != tuple(shape[:2]):
+            raise ValueError(f"Spatial shape {tuple(shape[:2])} does not match the climatology {self.sums.shape[:2]}")
+
+    def _add_rows(self, rows, data):
+        n_t = min(data.shape[2], self.n_doy)
+        data = np.asarray(data[:, :, :n_t], dtype=np.float64)
+        valid = ~np.isnan(data)
+        self.sums[rows, :, :n_t] += np.where(valid, data, 0)
+        self.counts[rows, :, :n_t] += valid
+
+    def add_year(self, data):
+        """
+        Add one yearly cube with shape (lat, lon, doy_max + 1).
+        """
+        self._allocate(data.shape)
+        self._add_rows(slice(None), data)
+        self.n_years += 1
+        self._climatology = None
+        return self
+
+    def add_file(self, nc_file, variable_name, row_chunk=100):
+        """
+        Add one yearly cube stored in a NetCDF file (latitude, longitude, doy), reading it in chunks of rows.
+        """
+        with netCDF4.Dataset(nc_file) as nc_data:
+            var = nc_data.variables[variable_name]
+            self._allocate(var.shape)
+            for i in range(0, var.shape[0], row_chunk):
+                # Raw values: fill values are masked before scale and offset are applied
+                data = decode_nc_values(*read_nc_variable(var, slice(i, i + row_chunk)))
+                self._add_rows(slice(i, i + row_chunk), data)
+        self.n_years += 1
+        self._climatology = None
+        return self
+
+    def add_files(self, nc_files, variable_name, row_chunk=100):
+        for nc_file in tqdm(nc_files, desc="Accumulating climatology"):
+            self.add_file(nc_file, variable_name, row_chunk)
+        return self
+
+    def merge(self, other):
+        """
+        Combine the sums and counts of another DOYClimatology (e.g., built from other years) into this one.
+        """
+        if other.sums is None:
+            return self
+        self._allocate(other.sums.shape)
+        self.sums += other.sums
+        self.counts += other.counts
+        self.n_years += other.n_years
+        self._climatology = None
+        return self
+
+    def climatology(self):
+        """
+        Return the +-window day climatology with shape (lat, lon, 367); index 0 is NaN.
+        The window wraps around the end of the year (DOY 366 is followed by DOY 1).
+        """
+        if self._climatology is not None:
+            return self._climatology
+        if self.sums is None:
+            raise ValueError("No data has been added to the climatology.")
+
+        k = self.window
+        sums = self.sums[:, :, 1:]
+        counts = self.counts[:, :, 1:]
+        n = sums.shape[2]
+
+        # circular moving sum with cumulative sums
+        pad_sums = np.concatenate((sums[:, :, n - k:], sums, sums[:, :, :k]), axis=2)
+        pad_counts = np.concatenate((counts[:, :, n - k:], counts, counts[:, :, :k]), axis=2)
+        cs_sums = np.concatenate((np.zeros(sums.shape[:2] + (1,)), np.cumsum(pad_sums, axis=2)), axis=2)
+        cs_counts = np.concatenate((np.zeros(counts.shape[:2] + (1,), dtype=np.int64), np.cumsum(pad_counts, axis=2)), axis=2)
+        window_sums = cs_sums[:, :, 2 * k + 1:] - cs_sums[:, :, :-(2 * k + 1)]
+        window_counts = cs_counts[:, :, 2 * k + 1:] - cs_counts[:, :, :-(2 * k + 1)]
+
+        clim = np.full(self.sums.shape, np.nan)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            clim[:, :, 1:] = np.where(window_counts >= self.min_count, window_sums / window_counts, np.nan)
+
+        self._climatology = clim
+        return clim
+
+    def anomaly(self, data):
+        """
+        Return the anomalies of a yearly cube with shape (lat, lon, doy_max + 1).
+        """
+        clim = self.climatology()
+        return data - clim[:, :, :data.shape[2]]
+
+    def anomaly_from_file(self, nc_file, variable_name, row_chunk=100):
+        """
+        Return the anomalies of a yearly cube stored in a NetCDF file, reading it in chunks of rows.
+        """
+        clim = self.climatology()
+        with netCDF4.Dataset(nc_file) as nc_data:
+            var = nc_data.variables[variable_name]
+            anomaly = np.full(var.shape, np.nan)
+            for i in range(0, var.shape[0], row_chunk):
+                # Raw values: fill values are masked before scale and offset are applied
+                data = decode_nc_values(*read_nc_variable(var, slice(i, i + row_chunk)))
+                anomaly[i:i + row_chunk] = data - clim[i:i + row_chunk, :, :data.shape[2]]
+        return anomaly
+
+    def save(self, file_path):
+        """
+        Save the accumulated sums and counts to a compressed .npz file.
+        """
+        np.savez_compressed(file_path, sums=self.sums, counts=self.counts, window=self.window,
+                            min_count=self.min_count, n_years=self.n_years)
+
+    @classmethod
+    def load(cls, file_path):
+        """
+        Load a DOYClimatology saved with save().
+        """
+        with np.load(file_path) as f:
+            clim = cls(window=int(f['window']), min_count=int(f['min_count']))
+            clim.sums = f['sums']
+            clim.counts = f['counts']
+            clim.n_years = int(f['n_years'])
+        return clim
@@ -71,23 +71,120 @@ def object_array_to_np(obj_data, target_np_array):
                 target_np_array[ii,jj,kk] = np.nanmean(obj_data[ii,jj,kk])
     return target_np_array
     
-def create_3d_np_array(x, y, z, fill_value = np.nan):
+def create_3d_np_array(x, y, z, fill_value = np.nan, packed=None):
     """
     Create a 3D NumPy array with the specified shape (x, y, z).
-    
+
     Parameters:
     x (int): Size of the first dimension.
     y (int): Size of the second dimension.
     z (int): Size of the third dimension.
-    
+    packed (dict): Optional PackedArray options (scale_factor, add_offset, dtype, fill_value); the data is then
+        held as scaled integers (4x less memory than float64) and decoded on read. fill_value is ignored.
+
     Returns:
-    np.ndarray: 3D NumPy array of shape (x, y, z).
+    np.ndarray: 3D NumPy array of shape (x, y, z) (or a PackedArray).
     """
-    if z == 0:
-        return np.full((x, y), fill_value)
-    else:
-        return np.full((x, y, z), fill_value)
-    
+    shape = (x, y) if z == 0 else (x, y, z)
+    if packed is not None:
+        return PackedArray(shape, **packed)
+    return np.full(shape, fill_value)
+
+class PackedArray:
+    """
+    Array stored as int16/uint16 with a scale factor, offset and fill sentinel (CF packing convention):
+    value = packed * scale_factor + add_offset, and NaN is stored as fill_value.
+
+    Assigning float values (e.g., data_array[:, :, doy] = t_data) encodes them; indexing decodes only the
+    requested part to float32, so whole-year cubes can be kept in memory and processed per tile.
+
+    Round-trip error bound: |decoded - original| <= scale_factor / 2 (rounding to the nearest level), plus the
+    float32 rounding of the decoding arithmetic (relative 2e-7). With the default scale_factor=1e-4 and int16,
+    soil moisture (m3/m3) is kept to +-5e-5 for values in [-3.2767, 3.2767] + add_offset.
+    Values outside the representable range raise a ValueError instead of being silently clipped.
+    """
+    def __init__(self, shape, scale_factor=1e-4, add_offset=0.0, dtype=np.int16, fill_value=None):
+        self.dtype = np.dtype(dtype)
+        if self.dtype not in (np.int16, np.uint16):
+            raise ValueError("dtype should be int16 or uint16")
+        info = np.iinfo(self.dtype)
+        # the fill sentinel is taken from one end of the integer range; the rest holds the data
+        if fill_value is None:
+            fill_value = info.min if self.dtype == np.int16 else info.max
+        self.fill_value = fill_value
+        self.valid_min = info.min + 1 if fill_value == info.min else info.min
+        self.valid_max = info.max - 1 if fill_value == info.max else info.max
+        self.scale_factor = scale_factor
+        self.add_offset = add_offset
+        self.packed = np.full(shape, fill_value, dtype=self.dtype)
+
+    @classmethod
+    def for_range(cls, shape, valid_range, dtype=np.int16):
+        """
+        Create a PackedArray whose levels span valid_range=(min, max) with the smallest scale factor.
+        """
+        packed = cls(shape, dtype=dtype)
+        packed.scale_factor = (valid_range[1] - valid_range[0]) / (packed.valid_max - packed.valid_min)
+        packed.add_offset = valid_range[0] - packed.valid_min * packed.scale_factor
+        return packed
+
+    @property
+    def shape(self):
+        return self.packed.shape
+
+    @property
+    def ndim(self):
+        return self.packed.ndim
+
+    @property
+    def nbytes(self):
+        return self.packed.nbytes
+
+    @property
+    def max_error(self):
+        return self.scale_factor / 2
+
+    def encode(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        levels = np.rint((values - self.add_offset) / self.scale_factor)
+        nan_mask = np.isnan(levels)
+        if np.any((levels[~nan_mask] < self.valid_min) | (levels[~nan_mask] > self.valid_max)):
+            vmin = self.valid_min * self.scale_factor + self.add_offset
+            vmax = self.valid_max * self.scale_factor + self.add_offset
+            raise ValueError(f"Values outside the packed range [{vmin}, {vmax}]")
+        levels[nan_mask] = self.fill_value
+        return levels.astype(self.dtype)
+
+    def decode(self, packed, dtype=np.float32):
+        packed = np.asarray(packed)
+        # computed in the output dtype, in place (no float64 temporaries)
+        values = packed.astype(dtype)
+        values *= values.dtype.type(self.scale_factor)
+        values += values.dtype.type(self.add_offset)
+        values[packed == self.fill_value] = np.nan
+        return values
+
+    def __setitem__(self, key, values):
+        self.packed[key] = self.encode(values)
+
+    def __getitem__(self, key):
+        return self.decode(self.packed[key])
+
+    def to_numpy(self, dtype=np.float32):
+        """
+        Decode the whole array (needs 2x (float32) or 4x (float64) the packed memory, plus a temporary fill mask
+        of half the packed memory).
+        """
+        return self.decode(self.packed, dtype)
+
+    def iter_tiles(self, tile_rows=100, dtype=np.float32):
+        """
+        Yield (rows, decoded tile) for tiles of tile_rows rows, decoding one tile at a time.
+        """
+        for i in range(0, self.shape[0], tile_rows):
+            rows = slice(i, min(i + tile_rows, self.shape[0]))
+            yield rows, self.decode(self.packed[rows], dtype)
+
 def load_data(input_fp, file_name, engine="c", clear_cache=False):
     
     if not hasattr(load_data, 'cache'):
@@ -0,0 +1,359 @@
+"""
+Datacube.py: A module for persistent, chunked data cubes of the satellite products.
+
+AnnualCube keeps one (latitude, longitude, doy) cube per product and year in a chunked NetCDF file, together
+with a JSON manifest of the ingested files (DOY, size and modification time). When new files land (e.g., one
+SMAP or AMSR2 file per day), update() detects the new or changed files from the file listing and reads and
+writes only the affected DOY slices instead of rebuilding the whole year.
+
+Example:
+file_list, data_doy = hSMAP.extract_filelist_doy(directory, year)
+read_slice = partial(hSMAP.read_h5_slice, group_name='Soil_Moisture_Retrieval_Data_AM', variable_name='soil_moisture')
+cube = AnnualCube(f'SMAP_AM_{year}.nc', year, 'soil_moisture')
+cube.update(file_list, data_doy, read_slice)
+data_array = cube.read()
+
+DataCubeStore holds a multi-year daily (lat, lon, time) cube as memory-mapped chunk files with a configurable
+chunk shape, so multi-year pixel analytics do not need to concatenate yearly arrays in memory.
+"""
+import os
+import json
+import calendar
+import tarfile
+import numpy as np
+import netCDF4
+from tqdm import tqdm
+
+from HydroAI.Parallel_IO import prefetch_map, NC_LOCK
+
+class AnnualCube:
+    def __init__(self, cube_path, year, variable_name, chunk_shape=(512, 512), dtype='f4', zlib=True):
+        """
+        Parameters:
+        - cube_path: Path of the NetCDF cube; the manifest is stored next to it (cube_path + '.manifest.json')
+        - year: Year of the cube (the doy axis has doy_max + 1 entries; index 0 is unused as in the readers)
+        - variable_name: Name of the variable in the NetCDF cube
+        - chunk_shape: (lat, lon) chunk size; every chunk holds a single DOY
+        - dtype: NetCDF dtype of the variable
+        - zlib: Compress the chunks
+        """
+        self.cube_path = cube_path
+        self.manifest_path = cube_path + '.manifest.json'
+        self.year = year
+        self.variable_name = variable_name
+        self.chunk_shape = chunk_shape
+        self.dtype = dtype
+        self.zlib = zlib
+        self.doy_max = 366 if calendar.isleap(year) else 365
+        self.manifest = self.load_manifest()
+
+    def load_manifest(self):
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                return json.load(f)
+        return {}
+
+    def save_manifest(self):
+        # write to a temporary file first so an interrupted job never leaves a broken manifest
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.manifest, f, indent=1)
+        os.replace(tmp_path, self.manifest_path)
+
+    @staticmethod
+    def file_signature(file_path):
+        stat = os.stat(file_path)
+        return {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+
+    def pending_files(self, file_list, data_doy):
+        """
+        Return the (file, doy) pairs that are not in the manifest yet, or whose size/modification time changed.
+        """
+        pending = []
+        for file_path, doy in zip(file_list, data_doy):
+            key = os.path.abspath(file_path)
+            entry = self.manifest.get(key)
+            signature = self.file_signature(file_path)
+            if entry is None or entry['doy'] != int(doy) or entry['size'] != signature['size'] or entry['mtime'] != signature['mtime']:
+                pending.append((file_path, int(doy)))
+        return pending
+
+    def create(self, shape):
+        """
+        Create the chunked NetCDF cube with shape (lat, lon) for every DOY, filled with NaN.
+        """
+        with netCDF4.Dataset(self.cube_path, 'w') as nc_data:
+            nc_data.createDimension('latitude', shape[0])
+            nc_data.createDimension('longitude', shape[1])
+            nc_data.createDimension('doy', self.doy_max + 1)
+            chunksizes = (min(self.chunk_shape[0], shape[0]), min(self.chunk_shape[1], shape[1]), 1)
+            nc_data.createVariable(self.variable_name, self.dtype, ('latitude', 'longitude', 'doy'),
+                                   zlib=self.zlib, chunksizes=chunksizes, fill_value=np.nan)
+            nc_data.year = self.year
+        self.manifest = {}
+        self.save_manifest()
+
+    def update(self, file_list, data_doy, read_slice, n_workers=4, prefetch=8, executor='thread'):
+        """
+        Read the new or changed files and write only their DOY slices into the cube.
+
+        Parameters:
+        - file_list, data_doy: File listing of the year (e.g., from extract_filelist_doy)
+        - read_slice: Function returning the decoded 2D array of a file (e.g., a partial of SMAP.read_h5_slice)
+        - n_workers, prefetch, executor: Reading pool (see Parallel_IO.prefetch_map)
+
+        Returns:
+        - updated: List of the DOYs that were written
+        """
+        # A manifest without its cube would skip the DOYs it lists: start over
+        if not os.path.exists(self.cube_path) and self.manifest:
+            print(f"Cube {self.cube_path} not found; its manifest is reset")
+            self.manifest = {}
+            self.save_manifest()
+
+        pending = self.pending_files(file_list, data_doy)
+        if len(pending) == 0:
+            return []
+
+        updated = []
+        results = prefetch_map(read_slice, [f for f, _ in pending], n_workers=n_workers, prefetch=prefetch, executor=executor)
+
+        nc_data = None
+        try:
+            for i, t_data, error in tqdm(results, total=len(pending), desc="Updating cube", unit="file"):
+                file_path, doy = pending[i]
+                if error is not None:
+                    if not isinstance(error, (OSError, tarfile.TarError)):
+                        raise error
+                    # The DOY is left as is, and the file stays pending for the next update
+                    print(f"Error processing file {file_path}: {error}")
+                    continue
+
+                # NetCDF readers may still be running in other threads (see Parallel_IO.NC_LOCK)
+                with NC_LOCK:
+                    if nc_data is None:
+                        if not os.path.exists(self.cube_path):
+                            self.create(t_data.shape)
+                        nc_data = netCDF4.Dataset(self.cube_path, 'a')
+                        var = nc_data.variables[self.variable_name]
+
+                    var[:, :, doy] = t_data
+                    nc_data.sync()
+
+                self.manifest[os.path.abspath(file_path)] = {'doy': doy, **self.file_signature(file_path)}
+                self.save_manifest()
+                updated.append(doy)
+        finally:
+            if nc_data is not None:
+                with NC_LOCK:
+                    nc_data.close()
+
+        return updated
+
+    def read(self, doy=None):
+        """
+        Read the whole cube (lat, lon, doy_max + 1), or a single DOY slice.
+        """
+        with netCDF4.Dataset(self.cube_path) as nc_data:
+            var = nc_data.variables[self.variable_name]
+            var.set_auto_mask(False)
+            if doy is None:
+                return np.asarray(var[:], dtype=np.float64)
+            return np.asarray(var[:, :, doy], dtype=np.float64)
+
+class DataCubeStore:
+    """
+    Multi-year daily (lat, lon, time) datacube stored as memory-mapped .npy chunk files in a directory.
+
+    The chunk shape sets the layout: map-major chunks, e.g., (lat, lon, 8), suit daily ingest (one date
+    touches one chunk column), while pixel-major chunks, e.g., (32, 32, n_time), keep the full time series of
+    a pixel contiguous on disk, so reading 10 years for one pixel is a single contiguous read.
+    Use transpose() to convert an ingested store to another chunk shape.
+
+    Example:
+    store = DataCubeStore.create('SMAP_store', (406, 964), '2016-01-01', '2025-12-31', chunk_shape=(406, 964, 8))
+    for year in range(2016, 2026):
+        store.write_year(data_array_of_year, year)
+    ts_store = store.transpose('SMAP_store_ts', chunk_shape=(16, 16, None))
+    ts = ts_store.read_pixel(200, 500)
+    """
+    metadata_file = 'metadata.json'
+
+    def __init__(self, directory):
+        """
+        Open an existing store (see create()).
+        """
+        self.directory = directory
+        with open(os.path.join(directory, self.metadata_file)) as f:
+            metadata = json.load(f)
+        self.shape = tuple(metadata['shape'])
+        self.chunk_shape = tuple(metadata['chunk_shape'])
+        self.dtype = np.dtype(metadata['dtype'])
+        self.fill_value = np.nan if metadata['fill_value'] is None else metadata['fill_value']
+        self.start_date = np.datetime64(metadata['start_date'], 'D')
+        self.dates = self.start_date + np.arange(self.shape[2])
+        self.n_chunks = tuple(int(np.ceil(n / c)) for n, c in zip(self.shape, self.chunk_shape))
+
+    @classmethod
+    def create(cls, directory, shape, start_date, end_date, chunk_shape=(None, None, 8), dtype='float32', fill_value=np.nan,
+               overwrite=False):
+        """
+        Create an empty store. Chunks are only written when data is written into them.
+        An existing store in the directory raises a FileExistsError, or is deleted (its metadata and chunk files)
+        with overwrite=True, so that no stale chunk of another layout is read back.
+
+        Parameters:
+        - directory: Directory of the store (created if needed)
+        - shape: (lat, lon) shape of the grid
+        - start_date, end_date: First and last date (inclusive), e.g., '2016-01-01'
+        - chunk_shape: (lat, lon, time) chunk shape; None means the full axis
+        - dtype: Data type of the stored values
+        - fill_value: Value of missing data (NaN, or a sentinel for integer types)
+        - overwrite: Delete an existing store in the directory
+        """
+        start_date = np.datetime64(start_date, 'D')
+        n_time = int((np.datetime64(end_date, 'D') - start_date).astype(int)) + 1
+        full_shape = (shape[0], shape[1], n_time)
+        chunk_shape = tuple(n if c is None else min(c, n) for c, n in zip(chunk_shape, full_shape))
+
+        os.makedirs(directory, exist_ok=True)
+        stale = [name for name in os.listdir(directory)
+                 if name == cls.metadata_file or (name.startswith('chunk_') and name.endswith('.npy'))]
+        if stale and not overwrite:
+            raise FileExistsError(f"{directory} already contains a store (use overwrite=True to replace it)")
+        for name in stale:
+            os.remove(os.path.join(directory, name))
+
+        metadata = {'shape': full_shape,
+                    'chunk_shape': chunk_shape,
+                    'dtype': np.dtype(dtype).str,
+                    'fill_value': None if np.isnan(fill_value) else np.asarray(fill_value).item(),
+                    'start_date': str(start_date)}
+        with open(os.path.join(directory, cls.metadata_file), 'w') as f:
+            json.dump(metadata, f, indent=1)
+        return cls(directory)
+
+    def time_index(self, date):
+        """
+        Return the time index of a date.
+        """
+        index = int((np.datetime64(date, 'D') - self.start_date).astype(int))
+        if index < 0 or index >= self.shape[2]:
+            raise ValueError(f"{date} is outside the store ({self.dates[0]} to {self.dates[-1]})")
+        return index
+
+    def _chunk_path(self, key):
+        return os.path.join(self.directory, 'chunk_{}_{}_{}.npy'.format(*key))
+
+    def _open_chunk(self, key, mode='r'):
+        path = self._chunk_path(key)
+        if os.path.exists(path):
+            return np.load(path, mmap_mode='r' if mode == 'r' else 'r+')
+        if mode == 'r':
+            return None
+        shape = tuple(min(c, n - k * c) for k, c, n in zip(key, self.chunk_shape, self.shape))
+        chunk = np.lib.format.open_memmap(path, mode='w+', dtype=self.dtype, shape=shape)
+        chunk[:] = self.fill_value
+        return chunk
+
+    def _chunk_regions(self, start, stop):
+        """
+        Yield (chunk key, slices within the chunk, slices within the region) for the region [start, stop).
+        """
+        ranges = []
+        for axis in range(3):
+            c = self.chunk_shape[axis]
+            axis_ranges = []
+            for k in range(start[axis] // c, (stop[axis] - 1) // c + 1):
+                lo = max(start[axis], k * c)
+                hi = min(stop[axis], (k + 1) * c)
+                axis_ranges.append((k, slice(lo - k * c, hi - k * c), slice(lo - start[axis], hi - start[axis])))
+            ranges.append(axis_ranges)
+
+        for r in ranges[0]:
+            for c in ranges[1]:
+                for t in ranges[2]:
+                    yield (r[0], c[0], t[0]), (r[1], c[1], t[1]), (r[2], c[2], t[2])
+
+    def _region(self, rows, cols, start_date, end_date):
+        rows = range(self.shape[0])[rows]
+        cols = range(self.shape[1])[cols]
+        if rows.step != 1 or cols.step != 1:
+            raise ValueError("Only contiguous row and column slices are supported")
+        t0 = 0 if start_date is None else self.time_index(start_date)
+        t1 = self.shape[2] if end_date is None else self.time_index(end_date) + 1
+        return (rows.start, cols.start, t0), (rows.stop, cols.stop, t1)
+
+    def write(self, data, start_date, rows=slice(None), cols=slice(None)):
+        """
+        Write a (lat, lon, time) array starting at start_date into the region rows x cols.
+        """
+        start, stop = self._region(rows, cols, start_date, None)
+        stop = (stop[0], stop[1], start[2] + data.shape[2])
+        if stop[2] > self.shape[2] or (stop[0] - start[0], stop[1] - start[1]) != data.shape[:2]:
+            raise ValueError(f"Data with shape {data.shape} does not fit in the store at {start_date}")
+
+        for key, chunk_slices, data_slices in self._chunk_regions(start, stop):
+            chunk = self._open_chunk(key, mode='w')
+            chunk[chunk_slices] = data[data_slices]
+            chunk.flush()
+            del chunk
+
+    def write_year(self, data_array, year):
+        """
+        Write a yearly reader cube (lat, lon, doy_max + 1), whose index 0 is unused, into the store.
+        The part of the year outside the store is ignored.
+        """
+        dates = np.datetime64(f'{year}-01-01', 'D') + np.arange(data_array.shape[2] - 1)
+        inside = (dates >= self.dates[0]) & (dates <= self.dates[-1])
+        if not np.any(inside):
+            return
+        first, last = np.flatnonzero(inside)[[0, -1]]
+        self.write(data_array[:, :, first + 1:last + 2], dates[first])
+
+    def read(self, rows=slice(None), cols=slice(None), start_date=None, end_date=None):
+        """
+        Read the region rows x cols between start_date and end_date (inclusive) as a (lat, lon, time) array.
+        """
+        start, stop = self._region(rows, cols, start_date, end_date)
+        out = np.full(tuple(b - a for a, b in zip(start, stop)), self.fill_value, dtype=self.dtype)
+        for key, chunk_slices, out_slices in self._chunk_regions(start, stop):
+            chunk = self._open_chunk(key)
+            if chunk is not None:
+                out[out_slices] = chunk[chunk_slices]
+        return out
+
+    def read_pixel(self, row, col, start_date=None, end_date=None):
+        """
+        Read the time series of one pixel.
+        """
+        return self.read(slice(row, row + 1), slice(col, col + 1), start_date, end_date)[0, 0]
+
+    def transpose(self, directory, chunk_shape=(32, 32, None), max_memory=2**30, overwrite=False):
+        """
+        Copy the store into a new store with another chunk shape, e.g., map-major ingest chunks into
+        pixel-major time series chunks. Blocks of whole output chunks are copied, each at most about
+        max_memory bytes (but at least one output chunk). overwrite replaces an existing store in directory
+        (see create()), which cannot be the directory of this store.
+
+        Returns:
+        - store: The new DataCubeStore
+        """
+        if os.path.realpath(directory) == os.path.realpath(self.directory):
+            raise ValueError("The transposed store needs another directory")
+        new = DataCubeStore.create(directory, self.shape[:2], self.dates[0], self.dates[-1],
+                                   chunk_shape=chunk_shape, dtype=self.dtype, fill_value=self.fill_value,
+                                   overwrite=overwrite)
+
+        # rows of output chunks per block
+        chunk_bytes = new.chunk_shape[0] * self.shape[1] * new.chunk_shape[2] * self.dtype.itemsize
+        block_rows = max(1, max_memory // chunk_bytes) * new.chunk_shape[0]
+
+        for r0 in tqdm(range(0, self.shape[0], block_rows), desc="Transposing store"):
+            r1 = min(r0 + block_rows, self.shape[0])
+            for t0 in range(0, self.shape[2], new.chunk_shape[2]):
+                t1 = min(t0 + new.chunk_shape[2], self.shape[2])
+                block = self.read(slice(r0, r1), slice(None), self.dates[t0], self.dates[t1 - 1])
+                new.write(block, self.dates[t0], rows=slice(r0, r1))
+
+        return new
@@ -1,8 +1,11 @@
 """
 ERA5_land.py: A module for processing reanalysis ERA5-based soil moisture data.
 
-(for monthly dataset)
+(for monthly dataset; aggregate_hourly aggregates the hourly dataset to daily and monthly statistics)
 
+create_array_from_nc reads a variable directly into a preallocated (lat, lon, time) array: each time step is read
+as two longitude hyperslabs (180~360 and 0~180) that land in their final (-180~180) positions, so the peak
+memory is the size of the output instead of the 3x of correct_shape (transpose + concatenate).
 """
 import os
 import glob
@@ -12,6 +15,9 @@ import h5py
 import netCDF4
 from tqdm import tqdm
 import calendar
+from functools import partial
+
+from HydroAI.Parallel_IO import prefetch_map, read_nc_variable, decode_nc_values, NC_LOCK
 
 def preprocess_lon_lat(lon, lat):
     # lat, lon edit for standard data shape
@@ -40,3 +46,266 @@ def create_mask(nc_data, var, var_data):
     except AttributeError:
         print(f"{var} has no FillValue attribute!")
     return var_data
+
+def wrap_longitude(lon):
+    """
+    Return the index where 0~360 longitudes reach 180 (the start of the 180~360 part), and the longitudes
+    rearranged to -180~180. Longitudes already in -180~180 are returned unchanged.
+    """
+    lon = np.asarray(lon, dtype=np.float64)
+    split = np.searchsorted(lon, 180) if lon.max() > 180 else len(lon)
+    return split, np.concatenate((lon[split:] - 360, lon[:split]))
+
+def lazy_lon_lat(lon, lat):
+    """
+    Return 2D longitude and latitude grids of a regular grid as read-only broadcast views of the 1D coordinates
+    (no memory is allocated for the grids).
+    """
+    shape = (len(lat), len(lon))
+    longitude = np.broadcast_to(np.asarray(lon)[np.newaxis, :], shape)
+    latitude = np.broadcast_to(np.asarray(lat)[:, np.newaxis], shape)
+    return longitude, latitude
+
+def create_array_from_nc(nc_file, variable_name, dtype=np.float64):
+    """
+    Read a (time, lat, lon) ERA5-Land variable into a (lat, lon, time) array with longitudes in -180~180.
+    Equivalent to correct_shape + create_mask (and the scale/offset applied by netCDF4), with a single copy.
+
+    Args:
+        nc_file (str): Path of the ERA5-Land NetCDF file.
+        variable_name (str): Variable name (e.g., 'swvl1').
+        dtype (np.dtype): Output dtype (np.float32 halves the memory).
+
+    Returns:
+        tuple: 3D array of data (NaN for fill values), and 2D longitude and latitude grids (read-only views).
+    """
+    with netCDF4.Dataset(nc_file) as nc_data:
+        lat = np.asarray(nc_data.variables['latitude'][:], dtype=np.float64)
+        split, lon = wrap_longitude(nc_data.variables['longitude'][:])
+
+        var = nc_data.variables[variable_name]
+        n_time, n_lat, n_lon = var.shape
+        n_west = n_lon - split
+        data_array = np.empty((n_lat, n_lon, n_time), dtype=dtype)
+
+        for t in range(n_time):
+            # (180~360) to the west part and (0~180) to the east part of the output
+            for out_cols, in_cols in ((slice(0, n_west), slice(split, n_lon)), (slice(n_west, n_lon), slice(0, split))):
+                raw, attrs = read_nc_variable(var, (t, slice(None), in_cols))
+                data_array[:, out_cols, t] = decode_nc_values(raw, attrs, dtype)
+
+    longitude, latitude = lazy_lon_lat(lon, lat)
+
+    return data_array, longitude, latitude
+
+def hours_since_epoch(time_var):
+    """
+    Convert a NetCDF time variable to integer hours since 1970-01-01 (UTC).
+    """
+    dates = netCDF4.num2date(time_var[:], time_var.units, getattr(time_var, 'calendar', 'standard'),
+                             only_use_cftime_datetimes=False, only_use_python_datetimes=True)
+    return np.array(dates, dtype='datetime64[h]').astype(np.int64)
+
+def offset_runs(lon, local_time):
+    """
+    Split the (native order) longitude columns into runs of the same UTC-to-local offset in hours
+    (round(lon / 15), i.e., solar time zones). Returns a list of (column slice, offset).
+    """
+    if not local_time:
+        return [(slice(0, len(lon)), 0)]
+    # Same labels as wrap_longitude: on 0~360 grids, 180 is labelled -180
+    lon = np.asarray(lon, dtype=np.float64)
+    if lon.max() > 180:
+        lon = np.where(lon >= 180, lon - 360, lon)
+    offsets = np.rint(lon / 15).astype(int)
+    edges = np.flatnonzero(np.diff(offsets)) + 1
+    starts = np.concatenate(([0], edges))
+    stops = np.concatenate((edges, [len(lon)]))
+    return [(slice(a, b), offsets[a]) for a, b in zip(starts, stops)]
+
+def aggregate_hourly_chunk(unit, variable_name, runs, dtype=np.float32):
+    """
+    Daily partial statistics of one time chunk of an hourly file.
+
+    Parameters:
+    - unit: (nc_file, t0, t1, hours) with hours the UTC hours since epoch of the time steps t0:t1
+    - variable_name: Variable name
+    - runs: Column runs and their local offsets (see offset_runs)
+
+    Returns:
+    - partials: Dictionary {day since epoch: (sum, count, min, max)} of (lat, lon) arrays
+    """
+    nc_file, t0, t1, hours = unit
+    with NC_LOCK:
+        with netCDF4.Dataset(nc_file) as nc_data:
+            values, attrs = read_nc_variable(nc_data.variables[variable_name], (slice(t0, t1), slice(None), slice(None)))
+    data = decode_nc_values(values, attrs, dtype)
+    shape = data.shape[1:]
+
+    partials = {}
+    for cols, offset in runs:
+        days = (hours + offset) // 24
+        for day in np.unique(days):
+            if day not in partials:
+                partials[day] = (np.zeros(shape, dtype=dtype), np.zeros(shape, dtype=np.int32),
+                                 np.full(shape, np.inf, dtype=dtype), np.full(shape, -np.inf, dtype=dtype))
+            block = data[days == day, :, cols]
+            valid = ~np.isnan(block)
+            p_sum, p_count, p_min, p_max = partials[day]
+            p_sum[:, cols] += np.sum(np.where(valid, block, 0), axis=0)
+            p_count[:, cols] += np.sum(valid, axis=0)
+            p_min[:, cols] = np.fmin(p_min[:, cols], np.fmin.reduce(block, axis=0))
+            p_max[:, cols] = np.fmax(p_max[:, cols], np.fmax.reduce(block, axis=0))
+    return partials
+
+def aggregate_hourly(file_list, variable_name, local_time=False, min_hours=1, time_chunk=24,
+                     n_workers=4, prefetch=8, executor='process', dtype=np.float32, out_dir=None, keep_daily=True):
+    """
+    Streaming aggregation of hourly ERA5-Land files into daily and monthly mean, min, max and sum.
+
+    The files are read in chunks of time_chunk hours (in parallel workers, see Parallel_IO.prefetch_map), in time
+    order. Each chunk's daily partial statistics are merged into the accumulators of the days still open, and a
+    day is flushed to the outputs (and merged into its month) as soon as no later chunk can reach it, so only a
+    few days are accumulated at a time. The daily outputs are stored time-major (contiguous day slices), in memory
+    or as .npy memory maps in out_dir, and returned as (lat, lon, day) views.
+    With local_time=True, each longitude column is assigned to the local (solar) day of its UTC offset
+    round(lon / 15); column runs with the same offset are processed together.
+    Note that ERA5-Land accumulated variables (e.g., tp, e) hold accumulations since 00 UTC: use min/max or the
+    00 UTC value rather than the sum for those.
+
+    Parameters:
+    - file_list: Hourly NetCDF files (time, latitude, longitude), e.g., one file per month
+    - variable_name: Variable name (e.g., 't2m', 'swvl1')
+    - local_time: Aggregate over local days instead of UTC days
+    - min_hours: Minimum number of valid hours for a daily value (NaN otherwise)
+    - time_chunk: Number of hours read per work unit
+    - n_workers, prefetch, executor: Reading pool
+    - dtype: Dtype of the data and of the accumulated statistics
+    - out_dir: Optional directory for the memory-mapped daily outputs (<variable>_daily_<statistic>.npy)
+    - keep_daily: Return the daily statistics (daily is None otherwise, and only the monthly ones are kept)
+
+    Returns:
+    - daily: Dictionary with 'dates' (datetime64[D]) and 'mean', 'min', 'max', 'sum', 'count' arrays (lat, lon, day)
+    - monthly: Dictionary with 'months' (datetime64[M]) and 'mean', 'min', 'max', 'sum', 'count' arrays
+      (lat, lon, month) of the valid daily values
+    - longitude, latitude: 2D grids (read-only views) in -180~180, matching the output columns
+    """
+    units = []
+    for nc_file in file_list:
+        with netCDF4.Dataset(nc_file) as nc_data:
+            hours = hours_since_epoch(nc_data.variables['valid_time' if 'valid_time' in nc_data.variables else 'time'])
+            lat = np.asarray(nc_data.variables['latitude'][:], dtype=np.float64)
+            lon_native = np.asarray(nc_data.variables['longitude'][:], dtype=np.float64)
+        for t0 in range(0, len(hours), time_chunk):
+            units.append((nc_file, t0, min(t0 + time_chunk, len(hours)), hours[t0:t0 + time_chunk]))
+    units.sort(key=lambda unit: unit[3].min())
+
+    split, lon = wrap_longitude(lon_native)
+    n_lon = len(lon)
+    n_west = n_lon - split
+    # (180~360) to the west part and (0~180) to the east part of the output
+    column_parts = ((slice(0, n_west), slice(split, n_lon)), (slice(n_west, n_lon), slice(0, split)))
+    runs = offset_runs(lon_native, local_time)
+    min_offset = min(offset for _, offset in runs)
+    max_offset = max(offset for _, offset in runs)
+
+    # The first day a unit (or any later unit) can reach: earlier open days are complete
+    unit_first_hour = np.array([unit[3].min() for unit in units])
+    next_first_day = np.append((np.minimum.accumulate(unit_first_hour[::-1])[::-1][1:] + min_offset) // 24, np.inf)
+    first_day = int((unit_first_hour.min() + min_offset) // 24)
+    n_days = int((max(unit[3].max() for unit in units) + max_offset) // 24 - first_day + 1)
+    dates = np.datetime64('1970-01-01', 'D') + first_day + np.arange(n_days)
+    months = dates.astype('datetime64[M]')
+    all_months = np.unique(months)
+
+    grid_shape = (len(lat), n_lon)
+    daily = None
+    if keep_daily:
+        daily = {}
+        if out_dir is not None:
+            os.makedirs(out_dir, exist_ok=True)
+        for name in ('mean', 'min', 'max', 'sum', 'count'):
+            out_dtype = np.int32 if name == 'count' else dtype
+            if out_dir is None:
+                daily[name] = np.empty((n_days,) + grid_shape, dtype=out_dtype)
+            else:
+                daily[name] = np.lib.format.open_memmap(os.path.join(out_dir, f'{variable_name}_daily_{name}.npy'),
+                                                        mode='w+', dtype=out_dtype, shape=(n_days,) + grid_shape)
+    monthly = {'mean': np.zeros((len(all_months),) + grid_shape, dtype=dtype),
+               'min': np.full((len(all_months),) + grid_shape, np.inf, dtype=dtype),
+               'max': np.full((len(all_months),) + grid_shape, -np.inf, dtype=dtype),
+               'sum': np.zeros((len(all_months),) + grid_shape, dtype=dtype),
+               'count': np.zeros((len(all_months),) + grid_shape, dtype=np.int32)}
+    has_data = np.zeros(n_days, dtype=bool)
+
+    def flush(d, p_sum, p_count, p_min, p_max):
+        # daily statistics of the complete day d, written in place, and merged into its month
+        valid = p_count >= min_hours
+        has_data[d] = p_count.any()
+        m = np.searchsorted(all_months, months[d])
+        for values in (p_sum, p_min, p_max):
+            np.copyto(values, np.nan, where=~valid)
+        np.add(monthly['sum'][m], p_sum, out=monthly['sum'][m], where=valid)
+        np.fmin(monthly['min'][m], p_min, out=monthly['min'][m])
+        np.fmax(monthly['max'][m], p_max, out=monthly['max'][m])
+        monthly['count'][m] += valid
+        if daily is not None:
+            daily['sum'][d] = p_sum
+            daily['min'][d] = p_min
+            daily['max'][d] = p_max
+            daily['count'][d] = p_count
+        # the sum accumulator becomes the daily mean
+        np.divide(p_sum, p_count, out=p_sum, where=valid)
+        np.add(monthly['mean'][m], p_sum, out=monthly['mean'][m], where=valid)
+        if daily is not None:
+            daily['mean'][d] = p_sum
+
+    open_days = {}
+    aggregate_chunk = partial(aggregate_hourly_chunk, variable_name=variable_name, runs=runs, dtype=dtype)
+    results = prefetch_map(aggregate_chunk, units, n_workers=n_workers, prefetch=prefetch, executor=executor)
+    for i, partials, error in tqdm(results, total=len(units), desc="Aggregating hourly data", unit="chunk"):
+        if error is not None:
+            raise error
+        for day, (p_sum, p_count, p_min, p_max) in partials.items():
+            d = day - first_day
+            if d not in open_days:
+                open_days[d] = (np.zeros(grid_shape, dtype=dtype), np.zeros(grid_shape, dtype=np.int32),
+                                np.full(grid_shape, np.inf, dtype=dtype), np.full(grid_shape, -np.inf, dtype=dtype))
+            o_sum, o_count, o_min, o_max = open_days[d]
+            for out_cols, in_cols in column_parts:
+                o_sum[:, out_cols] += p_sum[:, in_cols]
+                o_count[:, out_cols] += p_count[:, in_cols]
+                np.fmin(o_min[:, out_cols], p_min[:, in_cols], out=o_min[:, out_cols])
+                np.fmax(o_max[:, out_cols], p_max[:, in_cols], out=o_max[:, out_cols])
+
+        for d in sorted(d for d in open_days if d + first_day < next_first_day[i]):
+            flush(d, *open_days.pop(d))
+
+    # days that were never reached
+    if daily is not None:
+        for d in np.flatnonzero(~has_data):
+            for name in ('mean', 'min', 'max', 'sum'):
+                daily[name][d] = np.nan
+            daily['count'][d] = 0
+
+    # keep the days (and months) that have any data
+    data_days = np.flatnonzero(has_data)
+    days = slice(data_days[0], data_days[-1] + 1) if data_days.size else slice(0, 0)
+    kept_months = np.isin(all_months, np.unique(months[days]))
+
+    n_valid = monthly['count']
+    no_data = n_valid == 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        np.divide(monthly['mean'], n_valid, out=monthly['mean'], where=~no_data)
+    for name in ('mean', 'min', 'max', 'sum'):
+        np.copyto(monthly[name], np.nan, where=no_data)
+    monthly = {name: np.moveaxis(values[kept_months], 0, -1) for name, values in monthly.items()}
+    monthly['months'] = all_months[kept_months]
+
+    if daily is not None:
+        daily = {name: np.moveaxis(values[days], 0, -1) for name, values in daily.items()}
+        daily['dates'] = dates[days]
+
+    longitude, latitude = lazy_lon_lat(lon, lat)
+
+    return daily, monthly, longitude, latitude
@@ -0,0 +1,185 @@
+"""
+Early_Warning.py: A module for rolling early-warning (critical slowing down) indicators of (lat, lon, time) cubes.
+
+This module contains vectorized functions for rolling lag-k autocorrelation, variance and skewness, and the
+Kendall-tau trend of the indicators, e.g., for flash drought studies (projects/2024_flash_drought).
+The rolling moments are updated incrementally (the time step entering a window is added and the one leaving
+it is removed) instead of being recomputed per window, and spatial tiles can be processed in parallel.
+
+Window convention (as in critslowdown.ipynb): output index i uses data[:, :, i:i+win_size], and the lag-k
+autocorrelation pairs data[:, :, s+lag_size] with data[:, :, s] for s in [i, i+win_size-lag_size).
+"""
+import platform
+import numpy as np
+from functools import partial
+from tqdm import tqdm
+
+if platform.system() == 'Darwin':  # macOS
+    from multiprocessing import Pool
+else:  # assume Linux or other Unix-like system
+    from multiprocess import Pool
+
+def rolling_indicators(data, win_size, lag_size=1, min_valid=30):
+    """
+    Rolling lag-k autocorrelation, variance and skewness for every pixel, ignoring NaN values.
+    Assumes data has the shape (lat, lon, time).
+
+    Parameters:
+    - data: Input array with shape (lat, lon, time)
+    - win_size: Window length in time steps
+    - lag_size: Lag of the autocorrelation
+    - min_valid: Minimum number of valid values (or valid lag pairs) in a window; NaN otherwise
+
+    Returns:
+    - indicators: Dictionary with 'autocorr', 'variance', 'skewness' arrays of shape (lat, lon, time - win_size)
+    """
+    n_lat, n_lon, n_time = data.shape
+    n_windows = n_time - win_size
+    if n_windows <= 0:
+        raise ValueError(f"win_size ({win_size}) should be shorter than the time axis ({n_time})")
+
+    # shift by the per-pixel mean to keep the add/remove updates numerically stable
+    with np.errstate(invalid='ignore'):
+        shift = np.nan_to_num(np.nanmean(data, axis=2))
+
+    def value(t):
+        x = np.asarray(data[:, :, t], dtype=np.float64) - shift
+        valid = ~np.isnan(x)
+        return valid, np.where(valid, x, 0)
+
+    def pair_terms(s):
+        valid_a, a = value(s + lag_size)
+        valid_b, b = value(s)
+        v = valid_a & valid_b
+        a = np.where(v, a, 0)
+        b = np.where(v, b, 0)
+        return np.stack([v.astype(np.float64), a, b, a*a, b*b, a*b])
+
+    def single_terms(t):
+        v, x = value(t)
+        return np.stack([v.astype(np.float64), x, x*x, x*x*x])
+
+    pair_sums = np.zeros((6, n_lat, n_lon))
+    single_sums = np.zeros((4, n_lat, n_lon))
+    for s in range(0, win_size - lag_size):
+        pair_sums += pair_terms(s)
+    for t in range(0, win_size):
+        single_sums += single_terms(t)
+
+    autocorr = np.full((n_lat, n_lon, n_windows), np.nan)
+    variance = np.full((n_lat, n_lon, n_windows), np.nan)
+    skewness = np.full((n_lat, n_lon, n_windows), np.nan)
+
+    for i in range(n_windows):
+        if i > 0:
+            pair_sums += pair_terms(i + win_size - lag_size - 1) - pair_terms(i - 1)
+            single_sums += single_terms(i + win_size - 1) - single_terms(i - 1)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            n, Sa, Sb, Saa, Sbb, Sab = pair_sums
+            n = np.rint(n)
+            cov_ab = Sab - Sa * Sb / n
+            r = cov_ab / np.sqrt((Saa - Sa * Sa / n) * (Sbb - Sb * Sb / n))
+            autocorr[:, :, i] = np.where(n >= min_valid, r, np.nan)
+
+            n, S1, S2, S3 = single_sums
+            n = np.rint(n)
+            mean = S1 / n
+            m2 = S2 / n - mean * mean
+            m3 = S3 / n - 3 * mean * S2 / n + 2 * mean ** 3
+            enough = n >= min_valid
+            variance[:, :, i] = np.where(enough, m2, np.nan)
+            skewness[:, :, i] = np.where(enough, m3 / m2 ** 1.5, np.nan)
+
+    return {'autocorr': autocorr, 'variance': variance, 'skewness': skewness}
+
+def kendall_tau(data, min_valid=3, step=1):
+    """
+    Kendall rank correlation (tau-b) between each pixel's series and time, ignoring NaN values.
+    Assumes data has the shape (lat, lon, time); the computation is vectorized over pixels.
+
+    All pairs of time steps are compared, one lag at a time in preallocated buffers, so the cost is
+    O(time^2) per pixel (with memory of a single lag). For long series (e.g., multi-year daily indicators),
+    step subsamples the series (every step-th time step) and divides the cost by step^2.
+
+    Parameters:
+    - data: Input array with shape (lat, lon, time)
+    - min_valid: Minimum number of valid values (after subsampling); NaN otherwise
+    - step: Subsampling of the time axis
+
+    Returns:
+    - tau: Array with shape (lat, lon)
+    """
+    data = data[:, :, ::step]
+    n_time = data.shape[2]
+    S = np.zeros(data.shape[:2])
+    n_pairs = np.zeros(data.shape[:2])
+    ties = np.zeros(data.shape[:2])
+
+    # flat buffers, viewed as contiguous (lat, lon, time - d) arrays at every lag
+    diff_buffer = np.empty(data.shape[0] * data.shape[1] * max(n_time - 1, 0))
+    flag_buffer = np.empty(diff_buffer.size, dtype=bool)
+    with np.errstate(invalid='ignore'):
+        for d in range(1, n_time):
+            lag_shape = data.shape[:2] + (n_time - d,)
+            size = lag_shape[0] * lag_shape[1] * lag_shape[2]
+            diff = diff_buffer[:size].reshape(lag_shape)
+            flag = flag_buffer[:size].reshape(lag_shape)
+            np.subtract(data[:, :, d:], data[:, :, :-d], out=diff)
+
+            # comparisons with NaN differences are False
+            np.isnan(diff, out=flag)
+            n_pairs += (n_time - d) - np.count_nonzero(flag, axis=2)
+            np.equal(diff, 0, out=flag)
+            ties += np.count_nonzero(flag, axis=2)
+            np.greater(diff, 0, out=flag)
+            S += np.count_nonzero(flag, axis=2)
+            np.less(diff, 0, out=flag)
+            S -= np.count_nonzero(flag, axis=2)
+
+        n_valid = np.sum(~np.isnan(data), axis=2)
+        tau = S / np.sqrt((n_pairs - ties) * n_pairs)
+
+    tau[n_valid < min_valid] = np.nan
+
+    return tau
+
+def process_tile(tile, win_size, lag_size, min_valid, trend_step=1):
+    indicators = rolling_indicators(tile, win_size, lag_size, min_valid)
+    trends = {name: kendall_tau(values, step=trend_step) for name, values in indicators.items()}
+    return indicators, trends
+
+def early_warning_indicators(data, win_size, lag_size=1, min_valid=30, tile_rows=50, n_workers=8, trend_step=1):
+    """
+    Rolling autocorrelation, variance and skewness, and the Kendall-tau trends of these indicators,
+    for an entire (lat, lon, time) cube. Tiles of rows are processed in parallel workers.
+
+    Parameters:
+    - data: Input array with shape (lat, lon, time)
+    - win_size: Window length in time steps
+    - lag_size: Lag of the autocorrelation
+    - min_valid: Minimum number of valid values in a window
+    - tile_rows: Number of rows (lat) per tile
+    - n_workers: Number of worker processes (1 runs the tiles sequentially)
+    - trend_step: Subsampling of the indicators for the Kendall-tau trends (see kendall_tau)
+
+    Returns:
+    - indicators: Dictionary of arrays with shape (lat, lon, time - win_size) (see rolling_indicators)
+    - trends: Dictionary of Kendall-tau maps (lat, lon) of each indicator
+    """
+    # Only the rows of each tile are sent to the workers
+    tiles = [data[i:i + tile_rows] for i in range(0, data.shape[0], tile_rows)]
+    partial_process_tile = partial(process_tile, win_size=win_size, lag_size=lag_size, min_valid=min_valid,
+                                   trend_step=trend_step)
+
+    if n_workers > 1:
+        with Pool(n_workers) as p:
+            results = list(tqdm(p.imap(partial_process_tile, tiles), total=len(tiles), desc="Processing tiles"))
+    else:
+        results = [partial_process_tile(tile) for tile in tqdm(tiles, desc="Processing tiles")]
+
+    names = ['autocorr', 'variance', 'skewness']
+    indicators = {name: np.concatenate([r[0][name] for r in results], axis=0) for name in names}
+    trends = {name: np.concatenate([r[1][name] for r in results], axis=0) for name in names}
+
+    return indicators, trends
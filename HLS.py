@@ -9,6 +9,8 @@ import cartopy.crs as ccrs
 import cartopy.feature as cfeature
 import cartopy.mpl.gridliner as gridliner
 
+import HydroAI.QC as hQC
+
 class SentinelBandReader:
     def __init__(self, folder_path, product='S30'):
         self.product = product
@@ -381,13 +383,11 @@ def is_cloud(values):
     if np.any((values < 0) | (values > 255)):
         raise ValueError("All values must be between 0 and 255")
     
-    # Apply bitwise operations to check conditions across the entire array
-    cloud_free = (values & (1 << 1)) == 0
-    cloud_shadow_free = (values & (1 << 3)) == 0
-    not_adjacent_to_cloud_shadow = (values & (1 << 2)) == 0
+    # Cloud, cloud shadow, or adjacent to cloud/shadow, decoded with the QC lookup table
+    not_clear = hQC.any_flag_mask(values, 'HLS_Fmask', ['cloud', 'cloud_shadow', 'adjacent_cloud_shadow'])
 
-    # Combine conditions and return an array where 0 indicates clear and 1 indicates not clear
-    return np.where(cloud_free & cloud_shadow_free & not_adjacent_to_cloud_shadow, 0, 1)
+    # Return an array where 0 indicates clear and 1 indicates not clear
+    return not_clear.astype(int)
 
 def is_water(values):
     # Convert values to a numpy array if not already one
@@ -397,8 +397,8 @@ def is_water(values):
     if np.any((values < 0) | (values > 255)):
         raise ValueError("All values must be between 0 and 255")
 
-    # Apply bitwise operations to check water presence across the entire array
-    water_present = (values & (1 << 5)) != 0
+    # Check water presence across the entire array with the QC lookup table
+    water_present = hQC.flag_mask(values, 'HLS_Fmask', 'water')
 
     # Return an array where 1 indicates water present and 0 indicates no water
-    return np.where(water_present, 1, 0)
+    return water_present.astype(int)
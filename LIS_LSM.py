@@ -2,6 +2,12 @@ import os
 from netCDF4 import Dataset
 import numpy as np
 import datetime
+import bisect
+import time
+from functools import partial
+from tqdm import tqdm
+
+from HydroAI.Parallel_IO import prefetch_map, NC_LOCK
 
 def get_nc_file_paths(base_dir, contain='_HIST_'):
     """
@@ -161,4 +167,249 @@ def find_date_index(nc_file_paths, target_date_str):
             min_diff = diff
             closest_index = index
 
-    return closest_index
\ No newline at end of file
+    return closest_index
+
+def to_datetime(date):
+    """
+    Convert a 'yyyymmddhhmmss' (or 'yyyymmddhhmm', 'yyyymmdd') string, np.datetime64 or datetime to datetime.
+    """
+    if isinstance(date, datetime.datetime):
+        return date
+    if isinstance(date, np.datetime64):
+        return date.astype('datetime64[s]').astype(datetime.datetime)
+    formats = {14: '%Y%m%d%H%M%S', 12: '%Y%m%d%H%M', 8: '%Y%m%d'}
+    return datetime.datetime.strptime(date, formats[len(date)])
+
+def read_variable_block(variable, layer_index, rows, cols, dtype=np.float64):
+    """
+    Read the rows x cols block of one layer of a LIS variable (layer_index is ignored for 2D variables),
+    with np.nan for fill values.
+    """
+    variable.set_auto_maskandscale(True)
+    if variable.ndim == 4:
+        block = variable[layer_index, 0, rows, cols]
+    elif variable.ndim == 3:
+        block = variable[layer_index, rows, cols]
+    elif variable.ndim == 2:
+        block = variable[rows, cols]
+    else:
+        raise ValueError(f"Variable '{variable.name}' has unsupported number of dimensions: {variable.ndim}.")
+    return np.ma.filled(block.astype(dtype), np.nan)
+
+def read_points_from_nc(nc_file_path, variables, rows, cols):
+    """
+    Read the values of several variables at the grid cells (rows[k], cols[k]) of one LIS output file.
+    Only the rows x cols block of the unique rows and columns is read from each variable.
+
+    :param variables: List of (variable_name, layer_index) pairs (layer_index is ignored for 2D variables).
+    :return: Array with shape (len(variables), len(rows)), with np.nan for fill values.
+    """
+    rows_u, row_pos = np.unique(rows, return_inverse=True)
+    cols_u, col_pos = np.unique(cols, return_inverse=True)
+    values = np.full((len(variables), len(rows)), np.nan)
+
+    with NC_LOCK:
+        with Dataset(nc_file_path, 'r') as nc:
+            for v, (variable_name, layer_index) in enumerate(variables):
+                block = read_variable_block(nc.variables[variable_name], layer_index, rows_u, cols_u)
+                values[v] = block[row_pos, col_pos]
+
+    return values
+
+class LISArchive:
+    """
+    Sorted datetime index of LIS output files, with bisect-based nearest and range lookup and parallel
+    multi-point, multi-variable time series extraction.
+
+    Example:
+    archive = LISArchive.from_directory(LIS_LSM_FP)
+    nc_file = archive.nearest('20200701000000')
+    series, dates = archive.extract_points([(120, 340), (80, 15)], ['Evap_tavg', ('SoilMoist_tavg', 0)],
+                                           start='20200101', end='20201231')
+    """
+    def __init__(self, nc_file_paths):
+        """
+        :param nc_file_paths: LIS output file paths (e.g., from get_nc_file_paths); dates are parsed once.
+        """
+        entries = sorted((parse_date_from_path(path), path) for path in nc_file_paths)
+        self.dates = [date for date, _ in entries]
+        self.file_paths = [path for _, path in entries]
+
+    @classmethod
+    def from_directory(cls, base_dir, contain='_HIST_'):
+        return cls(get_nc_file_paths(base_dir, contain))
+
+    def __len__(self):
+        return len(self.file_paths)
+
+    def nearest_index(self, target_date):
+        """
+        Index of the file whose date is closest to target_date (ties go to the earlier file).
+        """
+        if len(self) == 0:
+            raise ValueError("The archive is empty.")
+        target_date = to_datetime(target_date)
+        i = bisect.bisect_left(self.dates, target_date)
+        if i == 0:
+            return 0
+        if i == len(self):
+            return len(self) - 1
+        return i - 1 if target_date - self.dates[i - 1] <= self.dates[i] - target_date else i
+
+    def nearest(self, target_date):
+        return self.file_paths[self.nearest_index(target_date)]
+
+    def range_indices(self, start=None, end=None):
+        """
+        Slice of the files with start <= date <= end (None means unbounded).
+        """
+        i0 = 0 if start is None else bisect.bisect_left(self.dates, to_datetime(start))
+        i1 = len(self) if end is None else bisect.bisect_right(self.dates, to_datetime(end))
+        return slice(i0, i1)
+
+    def files_between(self, start=None, end=None):
+        return self.file_paths[self.range_indices(start, end)]
+
+    def extract_points(self, points, variables, start=None, end=None, flip_data=True,
+                       n_workers=4, prefetch=8, executor='process'):
+        """
+        Extract the time series of several grid cells and variables across the archive, reading only the needed
+        cells from each file in parallel workers.
+
+        :param points: List of (row, col) grid indices (e.g., from Data.find_closest_index).
+        :param variables: Variable names, or (variable_name, layer_index) pairs for layered variables (layer 0 by default).
+        :param start, end: Optional date range (inclusive).
+        :param flip_data: Rows index the flipped (north-up) grid, as returned by get_variable_from_nc(flip_data=True).
+        :return: Dictionary {variable: array (len(points), n_time)} (keys as given in variables), and the dates.
+        """
+        variables = list(variables)
+        pairs = [(v, 0) if isinstance(v, str) else tuple(v) for v in variables]
+        rows = np.array([p[0] for p in points])
+        cols = np.array([p[1] for p in points])
+
+        file_paths = self.file_paths[self.range_indices(start, end)]
+        dates = self.dates[self.range_indices(start, end)]
+        if flip_data and len(file_paths) > 0:
+            with Dataset(file_paths[0], 'r') as nc:
+                n_rows = nc.variables[pairs[0][0]].shape[-2]
+            rows = n_rows - 1 - rows
+
+        series = np.full((len(pairs), len(points), len(file_paths)), np.nan)
+        read_points = partial(read_points_from_nc, variables=pairs, rows=rows, cols=cols)
+        results = prefetch_map(read_points, file_paths, n_workers=n_workers, prefetch=prefetch, executor=executor)
+        for i, values, error in tqdm(results, total=len(file_paths), desc="Extracting points", unit="file"):
+            if error is not None:
+                if not isinstance(error, OSError):
+                    raise error
+                # The time step stays NaN in case of an error
+                print(f"Error processing file {file_paths[i]}: {error}")
+                continue
+            series[:, :, i] = values
+
+        return {variable: series[v] for v, variable in enumerate(variables)}, dates
+
+def read_block_from_nc(nc_file_path, variables, rows, cols, dtype=np.float32):
+    """
+    Read the rows x cols block of several variables (and layers) from one LIS output file, opening it once.
+
+    :param variables: List of (variable_name, layer_index) pairs.
+    :return: Array with shape (len(variables), n_rows, n_cols) in the native (south-up) orientation.
+    """
+    with NC_LOCK:
+        with Dataset(nc_file_path, 'r') as nc:
+            return np.stack([read_variable_block(nc.variables[variable_name], layer_index, rows, cols, dtype)
+                             for variable_name, layer_index in variables])
+
+def create_cubes_from_nc(nc_file_paths, variables, bounds=None, out_dir=None, flip_data=True, dtype=np.float32,
+                         retries=2, n_workers=4, prefetch=8, executor='process'):
+    """
+    Build (lat, lon, time) cubes of several variables and layers (e.g., SoilMoist_tavg layers, Evap_tavg, Qs_tavg)
+    from LIS output files. Each file is read once in a worker pool (all variables, only the cells within bounds),
+    and written directly into per-variable outputs. With out_dir, the outputs are .npy memory maps stored as
+    (time, lat, lon), so every file is one contiguous write; the returned cubes are (lat, lon, time) views.
+    Files that fail (e.g., a transient I/O error) are retried up to `retries` more times and stay NaN otherwise.
+
+    :param nc_file_paths: LIS output files (e.g., from get_nc_file_paths or LISArchive.files_between).
+    :param variables: Variable names, or (variable_name, layer_index) pairs for layered variables (layer 0 by default).
+    :param bounds: Optional (lon_min, lon_max, lat_min, lat_max), as in Data.extract_region_from_data.
+    :param out_dir: Optional directory for the memory-mapped outputs (<variable>.npy, or <variable>_<layer>.npy).
+    :param flip_data: Return north-up rows, as get_variable_from_nc(flip_data=True).
+    :return: Dictionary {variable: cube} (keys as given in variables), dates, 2D longitude and latitude of the
+        cubes, and a report with the failed files and the throughput.
+    """
+    start_time = time.time()
+    variables = list(variables)
+    pairs = [(v, 0) if isinstance(v, str) else tuple(v) for v in variables]
+    n_time = len(nc_file_paths)
+
+    with Dataset(nc_file_paths[0], 'r') as nc:
+        latitude = read_variable_block(nc.variables['lat'], 0, slice(None), slice(None))
+        longitude = read_variable_block(nc.variables['lon'], 0, slice(None), slice(None))
+
+    # bounding box in the native orientation
+    rows, cols = slice(None), slice(None)
+    if bounds is not None:
+        lon_min, lon_max, lat_min, lat_max = bounds
+        in_rows = np.flatnonzero(np.any((latitude >= lat_min) & (latitude <= lat_max), axis=1))
+        in_cols = np.flatnonzero(np.any((longitude >= lon_min) & (longitude <= lon_max), axis=0))
+        if in_rows.size == 0 or in_cols.size == 0:
+            raise ValueError(f"No grid cells within bounds {bounds}")
+        rows = slice(in_rows[0], in_rows[-1] + 1)
+        cols = slice(in_cols[0], in_cols[-1] + 1)
+    latitude, longitude = latitude[rows, cols], longitude[rows, cols]
+    orient = (lambda block: block[::-1]) if flip_data else (lambda block: block)
+    latitude, longitude = orient(latitude), orient(longitude)
+    n_rows, n_cols = latitude.shape
+
+    outputs = []
+    for variable, (variable_name, layer_index) in zip(variables, pairs):
+        if out_dir is None:
+            outputs.append(np.full((n_time, n_rows, n_cols), np.nan, dtype=dtype))
+        else:
+            os.makedirs(out_dir, exist_ok=True)
+            file_name = variable if isinstance(variable, str) else f'{variable_name}_{layer_index}'
+            output = np.lib.format.open_memmap(os.path.join(out_dir, f'{file_name}.npy'), mode='w+',
+                                               dtype=dtype, shape=(n_time, n_rows, n_cols))
+            output[:] = np.nan
+            outputs.append(output)
+
+    read_block = partial(read_block_from_nc, variables=pairs, rows=rows, cols=cols, dtype=dtype)
+    pending = list(range(n_time))
+    for attempt in range(retries + 1):
+        failed = []
+        desc = "Reading files" if attempt == 0 else f"Retrying failed files ({attempt}/{retries})"
+        results = prefetch_map(read_block, [nc_file_paths[i] for i in pending],
+                               n_workers=n_workers, prefetch=prefetch, executor=executor)
+        for k, block, error in tqdm(results, total=len(pending), desc=desc, unit="file"):
+            t = pending[k]
+            if error is not None:
+                if not isinstance(error, (OSError, RuntimeError)):
+                    raise error
+                failed.append(t)
+                continue
+            for output, layer in zip(outputs, block):
+                output[t] = orient(layer)
+        pending = failed
+        if not pending:
+            break
+
+    for t in pending:
+        print(f"Error processing file {nc_file_paths[t]} after {retries} retries")
+    for output in outputs:
+        if isinstance(output, np.memmap):
+            output.flush()
+
+    elapsed = time.time() - start_time
+    n_read = n_time - len(pending)
+    n_bytes = n_read * len(pairs) * n_rows * n_cols * np.dtype(dtype).itemsize
+    report = {'n_files': n_time,
+              'failed': [nc_file_paths[t] for t in pending],
+              'elapsed': elapsed,
+              'files_per_s': n_read / elapsed if elapsed > 0 else np.nan,
+              'MB_per_s': n_bytes / 1e6 / elapsed if elapsed > 0 else np.nan}
+    print(f"{n_read}/{n_time} files in {elapsed:.1f} s ({report['files_per_s']:.1f} files/s, {report['MB_per_s']:.1f} MB/s)")
+
+    cubes = {variable: np.moveaxis(output, 0, -1) for variable, output in zip(variables, outputs)}
+    dates = [parse_date_from_path(path) for path in nc_file_paths]
+
+    return cubes, dates, longitude, latitude, report
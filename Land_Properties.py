@@ -8,32 +8,69 @@ import rioxarray
 from tqdm import tqdm
 
 import os
+from functools import partial
 
 import HydroAI.Grid as hGrid
 import HydroAI.Data as hData
+from HydroAI.Parallel_IO import prefetch_map
 
 # Define the majority filter function
-def majority_filter(data, size=3, nodata=-9999):
-    """1
+def majority_filter(data, size=3, nodata=-9999, tile_rows=2048, n_workers=1, executor='process'):
+    """
     Apply a majority filter to the input data.
+    The class counts of every window are computed for all pixels at once (one separable box sum per class), and
+    large rasters are processed in bands of tile_rows rows, with a halo of size // 2 rows, in parallel workers.
+    Ties go to the smallest class, and the windows are reflected at the raster edges (as ndimage.generic_filter).
     Args:
     - data: 2D array of data to be filtered.
-    - size: The size of the neighborhood used for the filter.
+    - size: The size of the neighborhood used for the filter (int or (rows, cols)).
     - nodata: Value to represent no-data in the input.
+    - tile_rows: Number of rows per band.
+    - n_workers: Number of workers (1 filters the bands sequentially).
+    - executor: 'process' or 'thread' pool (see Parallel_IO.prefetch_map).
     
     Returns:
     - Filtered data as a 2D array.
     """
-    def filter_func(x):
-        x = x[x != nodata]
-        x = x[x >= 0]
-        x = x.astype(int)
-        if len(x) == 0:
-            return nodata
-        else:
-            counts = np.bincount(x)
-            return np.argmax(counts)
-    return ndimage.generic_filter(data, filter_func, size=size)
+    sizes = tuple(int(s) for s in np.broadcast_to(size, 2))
+    halo = sizes[0] // 2
+    n_rows = data.shape[0]
+
+    tiles = []
+    for row_start in range(0, n_rows, tile_rows):
+        row_stop = min(row_start + tile_rows, n_rows)
+        top, bottom = max(row_start - halo, 0), min(row_stop + halo, n_rows)
+        tiles.append((data[top:bottom], row_start - top, row_stop - top))
+
+    filtered = np.empty_like(data)
+    filter_tile = partial(majority_filter_tile, sizes=sizes, nodata=nodata)
+    for i, result, error in prefetch_map(filter_tile, tiles, n_workers=n_workers, executor=executor):
+        if error is not None:
+            raise error
+        row_start = i * tile_rows
+        filtered[row_start:row_start + result.shape[0]] = result
+    return filtered
+
+def majority_filter_tile(tile, sizes, nodata):
+    """
+    Majority filter of the rows [start, stop) of a band (tile, start, stop), whose other rows are the halo.
+    Values equal to nodata or negative are not counted; windows without any counted value are nodata.
+    """
+    tile, start, stop = tile
+    valid = (tile != nodata) & (tile >= 0)
+    classes = np.where(valid, tile, 0).astype(int)
+
+    best_class = np.full(tile.shape, nodata)
+    best_count = np.zeros(tile.shape, dtype=np.int32)
+    for c in np.unique(classes[valid]):
+        counts = (valid & (classes == c)).astype(np.int32)
+        counts = ndimage.correlate1d(counts, np.ones(sizes[0], dtype=np.int32), axis=0, mode='reflect')
+        counts = ndimage.correlate1d(counts, np.ones(sizes[1], dtype=np.int32), axis=1, mode='reflect')
+        # Classes are visited in increasing order, so ties keep the smallest class
+        better = counts > best_count
+        best_class[better] = c
+        best_count[better] = counts[better]
+    return best_class[start:stop].astype(tile.dtype)
 
 def copernicus(FP, input_file, dst_crs, resolution, output_FP=None):
     """
@@ -74,7 +111,7 @@ def copernicus(FP, input_file, dst_crs, resolution, output_FP=None):
     rds = rds.rio.reproject(dst_crs, resolution=resolution)
     
     for i in range(rds.rio.count):
-        rds.values[i] = majority_filter(rds.values[i], size=3, nodata=-9999)
+        rds.values[i] = majority_filter(rds.values[i], size=3, nodata=-9999, n_workers=4)
     
     if not output_FP:
         # If an output file path was not specifically provided, remove the temporary file
@@ -0,0 +1,163 @@
+"""
+Parallel_IO.py: A module with the shared parallel reading utilities used by the product readers.
+
+prefetch_map runs a reader function over a list of files in a bounded thread or process pool and yields the
+results in the original order, so the caller (the main thread) only places finished slices into the output cube.
+
+create_array_from_slices is the shared core of the NetCDF cube builders (SMOS_CATDS, SMOS_IC, AMSR2_LPRM):
+each file is decoded once (fill value, scale and offset) and written, oriented, into its DOY slice.
+"""
+import calendar
+import tarfile
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import numpy as np
+import netCDF4
+from tqdm import tqdm
+
+import HydroAI.Data as hData
+
+def prefetch_map(func, items, n_workers=4, prefetch=8, executor='thread'):
+    """
+    Apply func to every item in a worker pool, reading at most `prefetch` items ahead of the consumer.
+
+    Results are yielded in the order of items as (index, result, error); error is None on success, and the
+    exception raised by func otherwise (result is then None), so per-file errors can be handled by the caller.
+
+    Parameters:
+    - func: Function of one argument (must be picklable for executor='process')
+    - items: Sequence of arguments (e.g., file paths)
+    - n_workers: Number of workers; 1 (or less) runs func sequentially in the calling thread
+    - prefetch: Maximum number of submitted but not yet consumed items
+    - executor: 'thread' or 'process'
+    """
+    if n_workers is None or n_workers <= 1:
+        for i, item in enumerate(items):
+            try:
+                yield i, func(item), None
+            except Exception as e:
+                yield i, None, e
+        return
+
+    if executor == 'thread':
+        pool = ThreadPoolExecutor(max_workers=n_workers)
+    elif executor == 'process':
+        pool = ProcessPoolExecutor(max_workers=n_workers)
+    else:
+        raise ValueError("executor should be 'thread' or 'process'")
+
+    prefetch = max(prefetch, n_workers)
+    items = list(items)
+    pending = deque()
+    next_item = 0
+
+    try:
+        while next_item < len(items) or pending:
+            while next_item < len(items) and len(pending) < prefetch:
+                pending.append((next_item, pool.submit(func, items[next_item])))
+                next_item += 1
+
+            i, future = pending.popleft()
+            try:
+                yield i, future.result(), None
+            except Exception as e:
+                yield i, None, e
+    finally:
+        for _, future in pending:
+            future.cancel()
+        pool.shutdown(wait=True)
+
+# The netCDF-C library is not thread-safe: with executor='thread', every netCDF4 call in the workers holds this
+# lock, including the reads, and so the HDF5 decompression of the chunks. Only the numpy decoding (and the
+# extraction of compressed archives, see SMOS_CATDS.read_tgz_slice) runs concurrently, so executor='thread'
+# mostly overlaps I/O with decoding. executor='process' reads and decompresses fully in parallel.
+NC_LOCK = threading.Lock()
+
+def read_nc_variable(variable, index=Ellipsis):
+    """
+    Read the raw values of a NetCDF variable (without netCDF4's masked arrays), or of the hyperslab index
+    (e.g., (slice(t0, t1), slice(None), slice(None))), and its decoding attributes.
+    """
+    variable.set_auto_maskandscale(False)
+    attrs = {attr: getattr(variable, attr) for attr in ('_FillValue', 'missing_value', 'scale_factor', 'add_offset')
+             if hasattr(variable, attr)}
+    return np.asarray(variable[index]), attrs
+
+def decode_nc_values(values, attrs, dtype=np.float64):
+    """
+    Decode raw NetCDF values: _FillValue/missing_value to NaN, then scale and offset (if present), in place.
+    """
+    t_data = values.astype(dtype)
+    for attr in ('_FillValue', 'missing_value'):
+        if attr in attrs:
+            t_data[np.isin(t_data, np.asarray(attrs[attr], dtype=dtype))] = np.nan
+    if 'scale_factor' in attrs:
+        t_data *= t_data.dtype.type(attrs['scale_factor'])
+    if 'add_offset' in attrs:
+        t_data += t_data.dtype.type(attrs['add_offset'])
+    return t_data
+
+def decode_nc_variable(variable, dtype=np.float64):
+    """
+    Read a NetCDF variable once and decode it (see decode_nc_values).
+    """
+    return decode_nc_values(*read_nc_variable(variable), dtype=dtype)
+
+def read_nc_slice(nc_file, variable_name, dtype=np.float64, memory=None):
+    """
+    Open a NetCDF file (or in-memory NetCDF bytes, with nc_file used as the name), read one variable and close
+    the file under NC_LOCK, then decode it (see decode_nc_values).
+    """
+    with NC_LOCK:
+        with netCDF4.Dataset(nc_file, mode='r', memory=memory) as nc_data:
+            values, attrs = read_nc_variable(nc_data.variables[variable_name])
+    return decode_nc_values(values, attrs, dtype)
+
+ORIENTATIONS = {
+    None: lambda t_data: t_data,
+    'flipud': lambda t_data: t_data[::-1],  # south-up rows to north-up rows
+    'transpose': lambda t_data: t_data.T,   # (lon, lat) to (lat, lon)
+}
+
+def create_array_from_slices(file_list, data_doy, year, read_slice, orientation=None,
+                             n_workers=4, prefetch=8, executor='process', packed=None):
+    """
+    Shared core of the NetCDF cube builders: every file is read and decoded exactly once in a worker pool, and
+    the main thread writes each decoded slice, oriented as a view (no copy), into its DOY of the output cube.
+
+    Parameters:
+    - file_list: File paths
+    - data_doy: DOY of each file
+    - year: Year of the data (sets the doy_max + 1 time axis; index 0 is unused)
+    - read_slice: Function of one file path returning the decoded 2D array (e.g., a partial of read_nc_slice)
+    - orientation: None, 'flipud' or 'transpose' (see ORIENTATIONS)
+    - n_workers, prefetch, executor: Reading pool (see prefetch_map)
+    - packed: Optional Data.PackedArray options to hold the cube as scaled integers
+
+    Returns:
+    - data_array: Array with shape (lat, lon, doy_max + 1); days without a readable file are NaN
+    """
+    if orientation not in ORIENTATIONS:
+        raise ValueError(f"orientation should be one of {list(ORIENTATIONS.keys())}")
+    orient = ORIENTATIONS[orientation]
+    doy_max = 366 if calendar.isleap(year) else 365
+    data_array = None
+
+    results = prefetch_map(read_slice, file_list, n_workers=n_workers, prefetch=prefetch, executor=executor)
+    for i, t_data, error in tqdm(results, total=len(file_list), desc="Processing files", unit="file"):
+        if error is not None:
+            if not isinstance(error, (OSError, tarfile.TarError)):
+                raise error
+            # The day stays NaN in case of an error
+            print(f"Error processing file {file_list[i]}: {error}")
+            continue
+
+        t_data = orient(t_data)
+        if data_array is None:
+            x, y = t_data.shape
+            data_array = hData.create_3d_np_array(x, y, doy_max + 1, packed=packed)
+
+        data_array[:, :, data_doy[i]] = t_data
+
+    return data_array
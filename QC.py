@@ -0,0 +1,186 @@
+"""
+QC.py: A module for decoding bit-flag quality-control (QC) layers of the satellite products.
+
+Each product has a table that maps flag names to bit positions. Flags are decoded for a whole cube at once
+with a lookup table (LUT) of 256 (8-bit) or 65536 (16-bit) entries: the LUT maps every possible flag value
+to the packed result, so decoding is a single indexing operation instead of one bitwise test per flag.
+
+Example:
+valid = hQC.valid_mask(qual_flag, 'SMAP_retrieval_qual_flag', ['not_recommended'])
+ice = hQC.flag_mask(lprm_flags, 'AMSR2_LPRM', 'ice')
+"""
+import numpy as np
+from functools import lru_cache
+
+QC_TABLES = {
+    # AMSR2 LPRM (bit numbering as in AMSR2_LPRM.create_mask)
+    'AMSR2_LPRM': {'n_bits': 16,
+                   'flags': {'negative_vod_X': 1,
+                             'negative_vod_C2': 2,
+                             'negative_vod_C1': 3,
+                             'high_vod_X': 4,
+                             'high_vod_C2': 5,
+                             'high_vod_C1': 6,
+                             'no_valid_data': 7,
+                             'ice': 8,
+                             'not_processed': 9}},
+    # HLS (Sentinel-2/Landsat) Fmask; bits 6-7 hold the aerosol level
+    'HLS_Fmask': {'n_bits': 8,
+                  'flags': {'cirrus': 0,
+                            'cloud': 1,
+                            'adjacent_cloud_shadow': 2,
+                            'cloud_shadow': 3,
+                            'snow_ice': 4,
+                            'water': 5,
+                            'aerosol_bit6': 6,
+                            'aerosol_bit7': 7}},
+    # SMAP L3 retrieval_qual_flag (a set bit means "no")
+    'SMAP_retrieval_qual_flag': {'n_bits': 16,
+                                 'flags': {'not_recommended': 0,
+                                           'retrieval_not_attempted': 1,
+                                           'retrieval_not_successful': 2,
+                                           'freeze_thaw_not_successful': 3}},
+    # SMAP L3 surface_flag
+    'SMAP_surface_flag': {'n_bits': 16,
+                          'flags': {'static_water': 0,
+                                    'radar_water': 1,
+                                    'coastal_proximity': 2,
+                                    'urban_area': 3,
+                                    'precipitation': 4,
+                                    'snow_ice': 5,
+                                    'permanent_snow_ice': 6,
+                                    'frozen_ground_radiometer': 7,
+                                    'frozen_ground_model': 8,
+                                    'mountainous_terrain': 9,
+                                    'dense_vegetation': 10,
+                                    'nadir_region': 11}},
+}
+
+def get_bit_positions(product, flags):
+    """
+    Return the bit positions of the flags (names, or integer positions) of a product.
+    """
+    if product not in QC_TABLES:
+        raise ValueError(f"Unknown product: {product}. Available products: {list(QC_TABLES.keys())}")
+    table = QC_TABLES[product]['flags']
+
+    positions = []
+    for flag in flags:
+        if isinstance(flag, (int, np.integer)):
+            positions.append(int(flag))
+        elif flag in table:
+            positions.append(table[flag])
+        else:
+            raise ValueError(f"Unknown flag for {product}: {flag}. Available flags: {list(table.keys())}")
+    return tuple(positions)
+
+@lru_cache(maxsize=None)
+def build_lut(n_bits, positions):
+    """
+    Build a LUT of 2**n_bits entries whose bit k is set where the bit at positions[k] is set.
+    The packed output dtype is the smallest unsigned integer with enough bits.
+    """
+    if len(positions) <= 8:
+        dtype = np.uint8
+    elif len(positions) <= 16:
+        dtype = np.uint16
+    else:
+        dtype = np.uint32
+
+    values = np.arange(2 ** n_bits, dtype=np.uint32)
+    lut = np.zeros(values.size, dtype=dtype)
+    for k, position in enumerate(positions):
+        lut |= (((values >> position) & 1) << k).astype(dtype)
+    lut.setflags(write=False)
+    return lut
+
+@lru_cache(maxsize=None)
+def build_any_lut(n_bits, positions):
+    """
+    Build a boolean LUT of 2**n_bits entries that is True where any of the bits at positions is set.
+    """
+    bits = 0
+    for position in positions:
+        bits |= 1 << position
+    lut = (np.arange(2 ** n_bits, dtype=np.uint32) & bits) != 0
+    lut.setflags(write=False)
+    return lut
+
+def as_index(values, n_bits, fill_value=None, invalid='raise'):
+    """
+    Convert flag values to LUT indices of the smallest unsigned dtype that holds n_bits (uint8 or uint16), in one
+    pass. NaN (e.g., days without data in float cubes) and fill_value are treated as no flag set.
+
+    Parameters:
+    - values: Array of flag values (any shape and dtype)
+    - n_bits: Number of bits of the flags
+    - fill_value: Optional raw fill value
+    - invalid: 'raise' on negative or out-of-range values, or 'zero' to treat them as no flag set
+    """
+    values = np.asarray(values)
+    index_dtype = np.uint8 if n_bits <= 8 else np.uint16
+    if values.dtype in (np.uint8, np.uint16) and np.iinfo(values.dtype).bits <= n_bits and fill_value is None:
+        return values
+
+    with np.errstate(invalid='ignore'):
+        out_of_range = (values < 0) | (values >= 2 ** n_bits)
+        if invalid == 'raise' and fill_value is not None:
+            out_of_range &= values != fill_value
+        if invalid == 'raise' and np.any(out_of_range):
+            raise ValueError(f"All values must be between 0 and {2 ** n_bits - 1}")
+        no_flag = out_of_range
+        if np.issubdtype(values.dtype, np.floating):
+            no_flag |= np.isnan(values)
+        if fill_value is not None:
+            no_flag |= values == fill_value
+
+    index = np.zeros(values.shape, dtype=index_dtype)
+    np.copyto(index, values, casting='unsafe', where=~no_flag)
+    return index
+
+def decode_flags(values, product, flags, fill_value=None):
+    """
+    Decode several flags at once into a packed mask.
+
+    Parameters:
+    - values: Array of flag values (any shape)
+    - product: Key of QC_TABLES
+    - flags: List of flag names (or bit positions)
+
+    Returns:
+    - packed: Array of the same shape as values; bit k is set where flags[k] is set
+    """
+    positions = get_bit_positions(product, flags)
+    n_bits = QC_TABLES[product]['n_bits']
+    lut = build_lut(n_bits, positions)
+    return lut[as_index(values, n_bits, fill_value)]
+
+def unpack_flag(packed, k):
+    """
+    Return the boolean mask of the k-th flag of a packed mask from decode_flags.
+    """
+    return (packed >> k) & 1 == 1
+
+def flag_mask(values, product, flag, fill_value=None):
+    """
+    Return the boolean mask where a single flag is set.
+    """
+    return any_flag_mask(values, product, [flag], fill_value)
+
+def any_flag_mask(values, product, flags, fill_value=None):
+    """
+    Return the boolean mask where any of the flags is set.
+    """
+    positions = get_bit_positions(product, flags)
+    n_bits = QC_TABLES[product]['n_bits']
+    lut = build_any_lut(n_bits, positions)
+    return lut[as_index(values, n_bits, fill_value)]
+
+def valid_mask(values, product, bad_flags, fill_value=None):
+    """
+    Return the combined validity mask: True where none of bad_flags is set (and values is not fill_value).
+    """
+    valid = ~any_flag_mask(values, product, bad_flags, fill_value)
+    if fill_value is not None:
+        valid &= np.asarray(values) != fill_value
+    return valid
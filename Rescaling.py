@@ -0,0 +1,212 @@
+"""
+Rescaling.py: A module for rescaling one (lat, lon, time) data cube to another, pixel by pixel.
+
+This module contains functions for computing per-pixel percentile (CDF) tables along the time axis,
+caching them to disk, CDF matching with piecewise-linear interpolation between the tables, and
+linear mean/std rescaling. All functions work on whole cubes and process them in chunks of rows.
+"""
+import os
+import numpy as np
+from tqdm import tqdm
+
+def percentile_table(data, percentiles=np.arange(0, 101, 5), chunk_size=100):
+    """
+    Calculate the percentiles of every pixel along the time axis, ignoring NaN values.
+    Assumes data has the shape (lat, lon, time).
+
+    Parameters:
+    - data: Input array with shape (lat, lon, time)
+    - percentiles: 1D sequence of percentiles in [0, 100] (ascending)
+    - chunk_size: Number of rows (lat) processed at once
+
+    Returns:
+    - table: Array with shape (lat, lon, n_percentiles); NaN where a pixel has no valid data
+    """
+    percentiles = np.asarray(percentiles, dtype=np.float64)
+    table = np.full((data.shape[0], data.shape[1], percentiles.size), np.nan)
+
+    for i in tqdm(range(0, data.shape[0], chunk_size), desc="Calculating percentile tables"):
+        chunk = data[i:i + chunk_size]
+        has_data = ~np.all(np.isnan(chunk), axis=2)
+        if not np.any(has_data):
+            continue
+        # nanpercentile returns (n_percentiles, n_pixels)
+        table[i:i + chunk_size][has_data] = np.nanpercentile(chunk[has_data], percentiles, axis=1).T
+
+    return table
+
+def mean_std_table(data, chunk_size=100):
+    """
+    Calculate the mean and standard deviation of every pixel along the time axis, ignoring NaN values.
+
+    Parameters:
+    - data: Input array with shape (lat, lon, time)
+    - chunk_size: Number of rows (lat) processed at once
+
+    Returns:
+    - mean, std: Arrays with shape (lat, lon)
+    """
+    mean = np.full(data.shape[:2], np.nan)
+    std = np.full(data.shape[:2], np.nan)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for i in range(0, data.shape[0], chunk_size):
+            chunk = data[i:i + chunk_size].astype(np.float64)
+            n_valid = np.sum(~np.isnan(chunk), axis=2)
+            m = np.nansum(chunk, axis=2) / n_valid
+            mean[i:i + chunk_size] = m
+            std[i:i + chunk_size] = np.sqrt(np.nansum((chunk - m[:, :, np.newaxis]) ** 2, axis=2) / n_valid)
+
+    return mean, std
+
+def save_percentile_table(file_path, table, percentiles):
+    """
+    Save a percentile table (and the percentiles it was computed for) to a compressed .npz file.
+    """
+    np.savez_compressed(file_path, table=table, percentiles=np.asarray(percentiles, dtype=np.float64))
+
+def load_percentile_table(file_path):
+    """
+    Load a percentile table saved by save_percentile_table.
+
+    Returns:
+    - table, percentiles
+    """
+    with np.load(file_path) as f:
+        return f['table'], f['percentiles']
+
+def cached_percentile_table(file_path, data=None, percentiles=np.arange(0, 101, 5), chunk_size=100):
+    """
+    Return the percentile table stored in file_path; compute and store it first if the file does not exist.
+    Use this for operational rescaling so the climatological tables are calculated only once.
+
+    Parameters:
+    - file_path: Path of the .npz cache file
+    - data: Input array with shape (lat, lon, time); only needed when the cache does not exist yet
+    - percentiles: 1D sequence of percentiles in [0, 100]
+    - chunk_size: Number of rows (lat) processed at once
+
+    Returns:
+    - table: Array with shape (lat, lon, n_percentiles)
+    """
+    percentiles = np.asarray(percentiles, dtype=np.float64)
+
+    if os.path.exists(file_path):
+        table, cached_percentiles = load_percentile_table(file_path)
+        if np.array_equal(cached_percentiles, percentiles):
+            return table
+        print(f"Percentiles in {file_path} differ from the requested ones. The table will be recalculated.")
+
+    if data is None:
+        raise ValueError(f"No cached percentile table in {file_path}, and no data to calculate it from.")
+
+    table = percentile_table(data, percentiles, chunk_size)
+    save_percentile_table(file_path, table, percentiles)
+
+    return table
+
+def interp_along_axis(x, xp, fp):
+    """
+    Piecewise-linear interpolation of x for every pixel at once (a vectorized np.interp along the last axis).
+    Values outside [xp[0], xp[-1]] are clamped to fp[0] and fp[-1] as in np.interp.
+
+    Parameters:
+    - x: Array with shape (lat, lon, time)
+    - xp: Ascending x-coordinates with shape (lat, lon, n)
+    - fp: y-coordinates with shape (lat, lon, n)
+
+    Returns:
+    - Interpolated array with shape (lat, lon, time)
+    """
+    n = xp.shape[2]
+
+    # index of the lower break point of the segment containing x
+    idx = np.zeros(x.shape, dtype=np.intp)
+    for k in range(1, n - 1):
+        idx += x >= xp[:, :, k:k + 1]
+
+    x0 = np.take_along_axis(xp, idx, axis=2)
+    x1 = np.take_along_axis(xp, idx + 1, axis=2)
+    f0 = np.take_along_axis(fp, idx, axis=2)
+    f1 = np.take_along_axis(fp, idx + 1, axis=2)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        w = np.where(x1 > x0, (x - x0) / (x1 - x0), 0)
+    w = np.clip(w, 0, 1)
+
+    interpolated = f0 + w * (f1 - f0)
+    interpolated[np.isnan(x) | np.isnan(x0)] = np.nan
+
+    return interpolated
+
+def CDF_matching(data, ref=None, data_table=None, ref_table=None, percentiles=np.arange(0, 101, 5), chunk_size=100):
+    """
+    Piecewise-linear CDF matching of data to ref for every pixel.
+    Each value is located in the percentile table of data and mapped to the same percentile of ref.
+
+    Tables can be given directly (e.g., from cached_percentile_table) so that only the mapping is computed.
+
+    Parameters:
+    - data: Array to be rescaled with shape (lat, lon, time)
+    - ref: Reference array with shape (lat, lon, time); only needed if ref_table is None
+    - data_table, ref_table: Optional percentile tables with shape (lat, lon, n_percentiles)
+    - percentiles: Percentiles used when the tables need to be calculated
+    - chunk_size: Number of rows (lat) processed at once
+
+    Returns:
+    - rescaled: Array with shape (lat, lon, time)
+    """
+    if data_table is None:
+        data_table = percentile_table(data, percentiles, chunk_size)
+    if ref_table is None:
+        if ref is None:
+            raise ValueError("Either ref or ref_table should be given.")
+        ref_table = percentile_table(ref, percentiles, chunk_size)
+
+    if data_table.shape != ref_table.shape:
+        raise ValueError(f"Shapes of the percentile tables do not match: {data_table.shape} and {ref_table.shape}")
+
+    rescaled = np.full(data.shape, np.nan, dtype=np.result_type(data.dtype, np.float32))
+
+    for i in range(0, data.shape[0], chunk_size):
+        rescaled[i:i + chunk_size] = interp_along_axis(data[i:i + chunk_size],
+                                                       data_table[i:i + chunk_size],
+                                                       ref_table[i:i + chunk_size])
+
+    return rescaled
+
+def linear_rescaling(data, ref=None, data_stats=None, ref_stats=None, chunk_size=100):
+    """
+    Linear (mean/std) rescaling of data to ref for every pixel:
+    rescaled = (data - mean_data) / std_data * std_ref + mean_ref
+
+    Parameters:
+    - data: Array to be rescaled with shape (lat, lon, time)
+    - ref: Reference array with shape (lat, lon, time); only needed if ref_stats is None
+    - data_stats, ref_stats: Optional (mean, std) tuples of 2D arrays (e.g., from mean_std_table)
+    - chunk_size: Number of rows (lat) processed at once
+
+    Returns:
+    - rescaled: Array with shape (lat, lon, time)
+    """
+    if data_stats is None:
+        data_stats = mean_std_table(data, chunk_size)
+    if ref_stats is None:
+        if ref is None:
+            raise ValueError("Either ref or ref_stats should be given.")
+        ref_stats = mean_std_table(ref, chunk_size)
+
+    mean_d, std_d = data_stats
+    mean_r, std_r = ref_stats
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        gain = std_r / std_d
+
+    rescaled = np.full(data.shape, np.nan, dtype=np.result_type(data.dtype, np.float32))
+
+    for i in range(0, data.shape[0], chunk_size):
+        s = slice(i, i + chunk_size)
+        rescaled[s] = ((data[s] - mean_d[s][:, :, np.newaxis]) * gain[s][:, :, np.newaxis]
+                       + mean_r[s][:, :, np.newaxis])
+
+    return rescaled
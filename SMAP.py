@@ -14,6 +14,11 @@ import h5py
 import netCDF4
 from tqdm import tqdm
 import calendar
+from functools import partial
+
+from HydroAI.Parallel_IO import prefetch_map
+import HydroAI.QC as hQC
+import HydroAI.Data as hData
 
 def extract_filelist_doy(directory, year):
     """
@@ -99,10 +104,99 @@ def get_e2grid(cpuserver_data_FP, mission_product):
 
     return longitude, latitude
 
-def create_array_from_h5(file_list, data_doy, year, cpuserver_data_FP, mission_product, variable_name, group_name):
+def decode_h5_dataset(dataset, dtype=np.float64):
+    """
+    Reads an h5py dataset once and decodes it.
+
+    Floating-point outputs get scale and offset applied and invalid data (outside valid_min/valid_max or equal
+    to _FillValue) set to NaN. Integer outputs (e.g., quality flags) are returned as stored.
+
+    Args:
+        dataset (h5py.Dataset): The dataset to read.
+        dtype (np.dtype): Output dtype.
+
+    Returns:
+        np.array: 2D array of the given dtype.
+    """
+    attrs = dataset.attrs
+    t_data = dataset[()].astype(dtype)
+
+    if not np.issubdtype(t_data.dtype, np.floating):
+        return t_data
+
+    # Get attributes and apply them if they exist
+    fill_value = np.float64(attrs.get('_FillValue', np.nan))
+    valid_min = np.float64(attrs.get('valid_min', -np.inf))
+    valid_max = np.float64(attrs.get('valid_max', np.inf))
+    scale_factor = attrs.get('scale_factor', 1.0)
+    add_offset = attrs.get('add_offset', 0.0)
+
+    # Apply scale and offset if applicable
+    if 'scale_factor' in attrs or 'add_offset' in attrs:
+        t_data *= t_data.dtype.type(scale_factor)
+        t_data += t_data.dtype.type(add_offset)
+
+    # Mask invalid data
+    t_data[(t_data < valid_min) | (t_data > valid_max) | (t_data == fill_value)] = np.nan
+
+    return t_data
+
+def read_h5_slice(h5_file, group_name, variable_name, dtype=np.float64,
+                  qc_variable=None, qc_product='SMAP_retrieval_qual_flag', qc_flags=('not_recommended',)):
+    """
+    Reads one variable from a SMAP .h5 file and decodes it (scale, offset, valid range and fill value masking).
+
+    Args:
+        h5_file (str): Path of the .h5 file.
+        group_name (str): The group name within the .h5 file.
+        variable_name (str): The variable name within the group.
+        dtype (np.dtype): Output dtype.
+        qc_variable (str): Optional bit-flag variable in the same group (e.g., 'retrieval_qual_flag').
+        qc_product (str): QC table of the flag variable (see QC.QC_TABLES).
+        qc_flags (list): Flags that make a retrieval invalid (set to NaN).
+
+    Returns:
+        np.array: 2D array with NaN for invalid data.
+    """
+    with h5py.File(h5_file, 'r') as hdf5_data:
+        t_data = decode_h5_dataset(hdf5_data[group_name][variable_name], dtype)
+
+        if qc_variable is not None:
+            qc_dataset = hdf5_data[group_name][qc_variable]
+            valid = hQC.valid_mask(qc_dataset[()], qc_product, qc_flags, qc_dataset.attrs.get('_FillValue', None))
+            t_data[~valid] = np.nan
+
+    return t_data
+
+def read_h5_slices(h5_file, variables, dtypes):
+    """
+    Opens a SMAP .h5 file once and decodes several variables.
+
+    Args:
+        h5_file (str): Path of the .h5 file.
+        variables (list): List of (group_name, variable_name) pairs.
+        dtypes (list): Output dtype of each variable.
+
+    Returns:
+        list: Decoded 2D arrays and the _FillValue of each variable.
+    """
+    with h5py.File(h5_file, 'r') as hdf5_data:
+        results = []
+        for (group_name, variable_name), dtype in zip(variables, dtypes):
+            dataset = hdf5_data[group_name][variable_name]
+            results.append((decode_h5_dataset(dataset, dtype), dataset.attrs.get('_FillValue', None)))
+        return results
+
+def create_array_from_h5(file_list, data_doy, year, cpuserver_data_FP, mission_product, variable_name, group_name,
+                         n_workers=4, prefetch=8, executor='thread',
+                         qc_variable=None, qc_product='SMAP_retrieval_qual_flag', qc_flags=('not_recommended',),
+                         packed=None):
     """
     Creates a 3D numpy array from a list of .h5 files containing variable data for each DOY.
 
+    Files are read and decoded concurrently by a bounded pool of workers that prefetch ahead of the main thread;
+    the main thread only places the finished slices into the array, in the order of file_list.
+
     Args:
         file_list (list): List of .h5 file paths.
         data_doy (list): List of corresponding DOYs for each file.
@@ -111,56 +205,114 @@ def create_array_from_h5(file_list, data_doy, year, cpuserver_data_FP, mission_p
         mission_product (str): The mission product name.
         variable_name (str): The variable name within the .h5 files.
         group_name (str): The group name within the .h5 files.
+        n_workers (int): Number of reading workers (1 reads the files sequentially).
+        prefetch (int): Maximum number of files decoded ahead of the main thread.
+        executor (str): 'thread' or 'process' pool.
+        qc_variable (str): Optional bit-flag variable in the same group (e.g., 'retrieval_qual_flag');
+            retrievals with any of qc_flags set are masked to NaN while decoding.
+        qc_product (str): QC table of the flag variable (see QC.QC_TABLES).
+        qc_flags (list): Flags that make a retrieval invalid.
+        packed (dict): Optional Data.PackedArray options, e.g., {'scale_factor': 1e-4}; the cube is then held as
+            int16 (4x less memory than float64) and decoded to float32 on indexing.
 
     Returns:
-        tuple: A 3D array of data, and 2D arrays of longitude and latitude.
+        tuple: A 3D array of data (or a Data.PackedArray), and 2D arrays of longitude and latitude.
     """
-    x, y = None, None
     doy_max = 366 if calendar.isleap(year) else 365
 
     # Initialize data_array with NaNs
     data_array = None
 
-    # Loop over the file list with a progress bar
-    for i, h5_file in enumerate(tqdm(file_list, desc="Processing files", unit="file")):
-        try:
-            with h5py.File(h5_file, 'r') as hdf5_data:
-                dataset = hdf5_data[group_name][variable_name]
-                
-                if data_array is None:
-                    # Get the shape of dataset from the first file
-                    x, y = dataset[:].shape
-                    data_array = np.full((x, y, doy_max + 1), np.nan)  # Create the array filled with NaN
-
-                t_data = dataset[:].astype(np.float64)
-
-                # Get attributes and apply them if they exist
-                fill_value = np.float64(dataset.attrs.get('_FillValue', np.nan))
-                valid_min = np.float64(dataset.attrs.get('valid_min', -np.inf))
-                valid_max = np.float64(dataset.attrs.get('valid_max', np.inf))
-                scale_factor = np.float64(dataset.attrs.get('scale_factor', 1.0))
-                add_offset = np.float64(dataset.attrs.get('add_offset', 0.0))
-
-                # Apply scale and offset if applicable
-                if 'scale_factor' in dataset.attrs or 'add_offset' in dataset.attrs:
-                    t_data = t_data * scale_factor + add_offset
-
-                # Mask invalid data
-                t_data = np.where((t_data < valid_min) | (t_data > valid_max) | (t_data == fill_value), np.nan, t_data)
-
-                # Get the corresponding doy value from the data_doy list
-                doy = data_doy[i]
-
-                # Assign the data to the array
-                data_array[:, :, doy] = t_data
-
-        except OSError as e:
-            print(f"Error processing file {h5_file}: {e}")
-            if data_array is not None and x is not None and y is not None:
-                # Mark the entire day as NaN in case of an error
-                data_array[:, :, data_doy[i]] = np.nan
+    read_slice = partial(read_h5_slice, group_name=group_name, variable_name=variable_name,
+                         qc_variable=qc_variable, qc_product=qc_product, qc_flags=qc_flags)
+    results = prefetch_map(read_slice, file_list, n_workers=n_workers, prefetch=prefetch, executor=executor)
+
+    # Loop over the decoded files with a progress bar
+    for i, t_data, error in tqdm(results, total=len(file_list), desc="Processing files", unit="file"):
+        if error is not None:
+            if not isinstance(error, OSError):
+                raise error
+            # The day stays NaN in case of an error
+            print(f"Error processing file {file_list[i]}: {error}")
+            continue
+
+        if data_array is None:
+            # Get the shape of dataset from the first file
+            x, y = t_data.shape
+            data_array = hData.create_3d_np_array(x, y, doy_max + 1, packed=packed)  # Create the array filled with NaN
+
+        # Assign the data to the array at the corresponding doy
+        data_array[:, :, data_doy[i]] = t_data
 
     # Get EASE2 lat/lon from the get_e2grid function
     longitude, latitude = get_e2grid(cpuserver_data_FP, mission_product)
     
-    return data_array, longitude, latitude
\ No newline at end of file
+    return data_array, longitude, latitude
+
+def create_arrays_from_h5(file_list, data_doy, year, cpuserver_data_FP, mission_product, variables, dtypes=None,
+                          fill_values=None, n_workers=4, prefetch=8, executor='thread'):
+    """
+    Creates 3D numpy arrays of several variables in a single traversal of the .h5 files.
+    Each file is opened once and all requested variables are decoded from it, e.g., AM and PM soil moisture,
+    retrieval quality flags, vegetation opacity and surface temperature.
+
+    Args:
+        file_list (list): List of .h5 file paths.
+        data_doy (list): List of corresponding DOYs for each file.
+        year (int): The year for which data is processed.
+        cpuserver_data_FP (str): File path where grid files are located.
+        mission_product (str): The mission product name.
+        variables (list): List of (group_name, variable_name) pairs.
+        dtypes (list or dict): Output dtype per variable (float64 by default). Integer dtypes keep the stored
+            values (e.g., bit flags); days without data are filled with a fill sentinel (see fill_values).
+        fill_values (dict): Optional fill sentinel per integer variable {(group_name, variable_name): value}.
+            By default the variable's _FillValue is used, or the maximum of the dtype if it has none, so that
+            missing days never look like valid values (e.g., 0 is "good quality" in the QC flags).
+        n_workers (int): Number of reading workers (1 reads the files sequentially).
+        prefetch (int): Maximum number of files decoded ahead of the main thread.
+        executor (str): 'thread' or 'process' pool.
+
+    Returns:
+        tuple: A dictionary {(group_name, variable_name): 3D array}, and 2D arrays of longitude and latitude.
+    """
+    variables = [tuple(v) for v in variables]
+    if dtypes is None:
+        dtypes = [np.float64] * len(variables)
+    elif isinstance(dtypes, dict):
+        dtypes = [dtypes.get(v, np.float64) for v in variables]
+    dtypes = [np.dtype(dtype) for dtype in dtypes]
+    fill_values = {} if fill_values is None else {tuple(v): value for v, value in fill_values.items()}
+
+    doy_max = 366 if calendar.isleap(year) else 365
+    data_arrays = {v: None for v in variables}
+
+    read_slices = partial(read_h5_slices, variables=variables, dtypes=dtypes)
+    results = prefetch_map(read_slices, file_list, n_workers=n_workers, prefetch=prefetch, executor=executor)
+
+    for i, slices, error in tqdm(results, total=len(file_list), desc="Processing files", unit="file"):
+        if error is not None:
+            if not isinstance(error, OSError):
+                raise error
+            # The day stays empty in case of an error
+            print(f"Error processing file {file_list[i]}: {error}")
+            continue
+
+        for v, dtype, (t_data, fill_value) in zip(variables, dtypes, slices):
+            if data_arrays[v] is None:
+                x, y = t_data.shape
+                if np.issubdtype(dtype, np.floating):
+                    empty_value = np.nan
+                elif v in fill_values:
+                    empty_value = fill_values[v]
+                elif fill_value is not None:
+                    empty_value = fill_value
+                else:
+                    empty_value = np.iinfo(dtype).max
+                data_arrays[v] = np.full((x, y, doy_max + 1), empty_value, dtype=dtype)
+
+            data_arrays[v][:, :, data_doy[i]] = t_data
+
+    # Get EASE2 lat/lon from the get_e2grid function
+    longitude, latitude = get_e2grid(cpuserver_data_FP, mission_product)
+
+    return data_arrays, longitude, latitude
@@ -1,6 +1,5 @@
 import netCDF4
 import numpy as np
-import calendar
 import os
 import tarfile
 import glob
@@ -8,10 +7,14 @@ import datetime
 import matplotlib.pyplot as plt
 import cartopy.crs as ccrs
 import cartopy.feature
+from functools import partial
+
+from HydroAI.Parallel_IO import create_array_from_slices, read_nc_slice
 
 def extract_tgz_files(root_dir, year):
     """
     Extract all .tgz files found in subdirectories of the specified root directory.
+    Consider create_array_from_tgz, which reads the archives directly without extracting them.
 
     Parameters:
     root_dir (str): Path to the root directory.
@@ -29,13 +32,90 @@ def extract_tgz_files(root_dir, year):
                 for file_name in os.listdir(day_path):
                     if file_name.endswith('.tgz'):
                         file_path = os.path.join(day_path, file_name)
-                        # Check if the extracted files already exist
-                        tar = tarfile.open(file_path, 'r:gz')
-                        extract_dir = os.path.splitext(os.path.join(day_path, file_name))[0]
+                        # Extract the archive file only if the extracted files don't already exist
+                        extract_dir = os.path.splitext(file_path)[0]
                         if not os.path.isdir(extract_dir):
-                            # Extract the archive file if the extracted files don't already exist
-                            tar.extractall(day_path)
-                            tar.close() 
+                            with tarfile.open(file_path, 'r:gz') as tar:
+                                tar.extractall(day_path)
+
+def extract_tgz_filelist_doy(root_dir, year, orbit='A'):
+    """
+    List the .tgz archives of one orbit (A or D) and year, and their day of the year (DOY).
+
+    Parameters:
+    root_dir (str): Path to the root directory (root_dir/orbit/year/day_dir/*.tgz).
+    year (int): Year of the archives.
+    orbit (str): 'A' (ascending) or 'D' (descending).
+
+    Returns:
+    tuple: Lists of archive paths and DOYs, sorted by DOY.
+    """
+    data = []
+    dir_path = os.path.join(root_dir, orbit, str(year))
+    for tgz_file in glob.glob(os.path.join(dir_path, '*', '*.tgz')):
+        # The archive is named like the NetCDF file it holds
+        date_str = os.path.basename(tgz_file).split('_')[4][:8]
+        date_obj = datetime.datetime.strptime(date_str, '%Y%m%d')
+        data.append((tgz_file, date_obj.timetuple().tm_yday))
+
+    data.sort(key=lambda x: x[1])
+    file_list, data_doy = zip(*data) if data else ([], [])
+
+    return list(file_list), list(data_doy)
+
+def read_nc_bytes_from_tgz(tgz_file):
+    """
+    Read the NetCDF file of a .tgz archive into memory, without extracting it to disk.
+
+    Returns:
+    tuple: Name and bytes of the NetCDF member.
+    """
+    with tarfile.open(tgz_file, 'r:gz') as tar:
+        for member in tar:
+            if member.isfile() and member.name.endswith('.nc'):
+                with tar.extractfile(member) as f:
+                    return os.path.basename(member.name), f.read()
+    raise OSError(f"No NetCDF file in {tgz_file}")
+
+def read_tgz_slice(tgz_file, variable_name):
+    """
+    Read and decode one variable from the NetCDF file in a .tgz archive (as stored, i.e., south-up rows).
+    The archive is extracted outside the NetCDF lock, so thread workers extract archives concurrently (the NetCDF
+    read of the extracted bytes, including its chunk decompression, holds the lock).
+    """
+    nc_name, nc_bytes = read_nc_bytes_from_tgz(tgz_file)
+    return read_nc_slice(nc_name, variable_name, memory=nc_bytes)
+
+def create_array_from_tgz(file_list, data_doy, year, variable_name, n_workers=4, prefetch=8, executor='process', packed=None):
+    """
+    Create a 3D array (lat, lon, doy_max + 1) from daily .tgz archives, reading the NetCDF file of each archive
+    in memory, so the extracted tree never has to exist on disk. The archives are decompressed and decoded
+    in parallel workers (see Parallel_IO.prefetch_map).
+
+    Parameters:
+    file_list (list): .tgz archive paths (e.g., from extract_tgz_filelist_doy).
+    data_doy (list): DOY of each archive.
+    year (int): Year of the data.
+    variable_name (str): Variable name in the NetCDF files (e.g., 'Soil_Moisture', 'RFI_Prob').
+    n_workers (int): Number of workers (1 reads the archives sequentially).
+    prefetch (int): Maximum number of archives decoded ahead of the main thread.
+    executor (str): 'process' or 'thread' pool (NetCDF reads are serialized in thread workers).
+    packed (dict): Optional Data.PackedArray options to hold the cube as scaled integers.
+
+    Returns:
+    tuple: A 3D array of data, and 2D arrays of longitude and latitude.
+    """
+    read_slice = partial(read_tgz_slice, variable_name=variable_name)
+    data_array = create_array_from_slices(file_list, data_doy, year, read_slice, orientation='flipud',
+                                          n_workers=n_workers, prefetch=prefetch, executor=executor, packed=packed)
+
+    nc_name, nc_bytes = read_nc_bytes_from_tgz(file_list[0])
+    with netCDF4.Dataset(nc_name, mode='r', memory=nc_bytes) as nc_data:
+        lat = np.flipud(nc_data.variables['lat'][:])
+        lon = nc_data.variables['lon'][:]
+    longitude, latitude = np.meshgrid(lon, lat)
+
+    return data_array, longitude, latitude
 
 def extract_filelist_doy(directory):
     data_doy = []
@@ -74,46 +154,32 @@ def replace_fill_value(data, fill_value):
     data[data == fill_value] = np.nan
     return data
 
-def create_array_from_nc(file_list, data_doy, year, variable_name):
-    # Read data from the first NC file
-    nc_data = netCDF4.Dataset(file_list[0])
-    fill_value = np.float64(nc_data.variables[variable_name]._FillValue)
-    #print(nc_data.variables)
-    t_data        = np.flipud(nc_data.variables[variable_name][:])
-    x, y = t_data.shape[:2]
-
-    doy_max = 366 if calendar.isleap(year) else 365
-
-    # Create the array filled with NaN
-    data_array = np.empty((x, y, doy_max + 1))
-    data_array[:] = np.nan
-
-    # Loop over the file list
-    for i, nc_file in enumerate(file_list):
-        # Read data from the NC file
-        nc_data = netCDF4.Dataset(nc_file)
-        t_data = np.flipud(nc_data.variables[variable_name][:])
-    
-        # Get the corresponding doy value from the data_doy list
-        doy = data_doy[i]
+def create_array_from_nc(file_list, data_doy, year, variable_name, n_workers=4, prefetch=8, executor='process', packed=None):
+    """
+    Create a 3D array (lat, lon, doy_max + 1) from the daily NetCDF files. Each file is opened and decoded once
+    (fill value to NaN, scale and offset) in parallel workers, and written flipped into its DOY slice.
 
-        # Assign the data to the array
-        data_array[:, :, doy] = t_data
+    Parameters:
+    file_list (list): NetCDF file paths.
+    data_doy (list): DOY of each file.
+    year (int): Year of the data.
+    variable_name (str): Variable name in the NetCDF files (e.g., 'Soil_Moisture', 'RFI_Prob').
+    n_workers (int): Number of workers (1 reads the files sequentially).
+    prefetch (int): Maximum number of files decoded ahead of the main thread.
+    executor (str): 'process' or 'thread' pool (NetCDF reads are serialized in thread workers).
+    packed (dict): Optional Data.PackedArray options to hold the cube as scaled integers.
 
-        # Close the NC file
-        nc_data.close()
-    
-    nc_data = netCDF4.Dataset(file_list[0])
-    lat = np.flipud(nc_data.variables['lat'][:])
-    lon = (nc_data.variables['lon'][:])
+    Returns:
+    tuple: A 3D array of data, and 2D arrays of longitude and latitude.
+    """
+    read_slice = partial(read_nc_slice, variable_name=variable_name)
+    data_array = create_array_from_slices(file_list, data_doy, year, read_slice, orientation='flipud',
+                                          n_workers=n_workers, prefetch=prefetch, executor=executor, packed=packed)
+
+    with netCDF4.Dataset(file_list[0]) as nc_data:
+        lat = np.flipud(nc_data.variables['lat'][:])
+        lon = nc_data.variables['lon'][:]
     longitude, latitude = np.meshgrid(lon, lat)
-   
-    data_array = replace_fill_value(data_array, fill_value)
-    
-    if variable_name == 'RFI_Prob':
-        add_offset    = nc_data.variables[variable_name].add_offset
-        scale_factor  = nc_data.variables[variable_name].scale_factor
-        data_array = apply_scale_offset(data_array, add_offset, scale_factor)
 
     return data_array, longitude, latitude
 
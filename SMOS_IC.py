@@ -8,11 +8,9 @@ from the processed data.
 import os
 import glob
 import datetime
-import numpy as np
-import h5py
-import netCDF4
-from tqdm import tqdm
-import calendar
+from functools import partial
+
+from HydroAI.Parallel_IO import create_array_from_slices, read_nc_slice
 
 def extract_filelist_doy(directory, year):
     """
@@ -56,31 +54,29 @@ def extract_filelist_doy(directory, year):
 
     return file_list, data_doy
 
-def create_array_from_nc(file_list, data_doy, year, variable_name):
-    # Read data from the first NC file
-    nc_data = netCDF4.Dataset(file_list[0])
-    t_data = np.flipud(nc_data.variables[variable_name][:])
-    x, y = t_data.shape[:2]
-
-    doy_max = 366 if calendar.isleap(year) else 365
-
-    # Create the array filled with NaN
-    data_array = np.empty((x, y, doy_max + 1))
-    data_array[:] = np.nan
+def create_array_from_nc(file_list, data_doy, year, variable_name,
+                         n_workers=4, prefetch=8, executor='process', packed=None):
+    """
+    Creates a 3D numpy array from a list of .nc files containing variable data for each DOY.
 
-    # Loop over the file list with a progress bar
-    for i, nc_file in enumerate(tqdm(file_list, desc="Processing files")):
-        # Read data from the NC file
-        nc_data = netCDF4.Dataset(nc_file)
-        t_data = np.flipud(nc_data.variables[variable_name][:])
-    
-        # Get the corresponding doy value from the data_doy list
-        doy = data_doy[i]
+    Each file is opened and decoded once (fill value to NaN, scale and offset) by a pool of workers, and the
+    main thread writes the slice, flipped, into its DOY (see Parallel_IO.create_array_from_slices).
 
-        # Assign the data to the array
-        data_array[:, :, doy] = t_data
+    Args:
+        file_list (list): List of .nc file paths.
+        data_doy (list): List of corresponding DOYs for each file.
+        year (int): The year for which data is processed.
+        variable_name (str): The variable name within the .nc files.
+        n_workers (int): Number of reading workers (1 reads the files sequentially).
+        prefetch (int): Maximum number of files decoded ahead of the main thread.
+        executor (str): 'process' or 'thread' pool (NetCDF reads are serialized in thread workers).
+        packed (dict): Optional Data.PackedArray options to hold the cube as scaled integers.
 
-        # Close the NC file
-        nc_data.close()
+    Returns:
+        np.array: 3D array of data with NaN for missing days and fill values.
+    """
+    read_slice = partial(read_nc_slice, variable_name=variable_name)
+    data_array = create_array_from_slices(file_list, data_doy, year, read_slice, orientation='flipud',
+                                          n_workers=n_workers, prefetch=prefetch, executor=executor, packed=packed)
 
     return data_array
@@ -13,6 +13,15 @@ import h5py
 import netCDF4
 from tqdm import tqdm
 import calendar
+import hashlib
+from collections import OrderedDict
+from functools import partial
+from scipy.interpolate import interp1d
+from scipy.ndimage import zoom
+
+from HydroAI.Parallel_IO import create_array_from_slices
+
+HE5_HEMISPHERES = {'N': 'Northern', 'S': 'Southern'}
 
 def extract_filelist_doy_he5(directory, year):
     """
@@ -61,3 +70,180 @@ def replace_inf_with_nan(lat, lon, data):
     inf_mask = np.isinf(lat) | np.isinf(lon)
     data[inf_mask] = np.nan
     return data
+
+def he5_paths(hemisphere='N', variable='SWE'):
+    """
+    HDF-EOS paths of a daily variable and its geolocation in the AMSR-E/AMSR2 .he5 files.
+
+    Args:
+        hemisphere (str): 'N' or 'S'.
+        variable (str): Variable prefix (e.g., 'SWE', 'Flags').
+
+    Returns:
+        tuple: Paths of the variable, latitude and longitude.
+    """
+    name = HE5_HEMISPHERES[hemisphere]
+    grid = f'HDFEOS/GRIDS/{name} Hemisphere'
+    return f'{grid}/Data Fields/{variable}_{name}Daily', f'{grid}/lat', f'{grid}/lon'
+
+def read_he5(he5_file, hemisphere='N', variable='SWE', geolocation=True, rows=slice(None), cols=slice(None)):
+    """
+    Read a daily variable (and its geolocation) of one hemisphere from a .he5 file, opening the file once and
+    reading only the rows x cols hyperslab.
+
+    Args:
+        he5_file (str): Path to the .he5 file.
+        hemisphere (str): 'N' or 'S'.
+        variable (str): Variable prefix (e.g., 'SWE', 'Flags').
+        geolocation (bool): Also read latitude and longitude.
+        rows, cols (slice): Hyperslab to read.
+
+    Returns:
+        np.array or tuple: The variable as float64, or the variable, latitude and longitude.
+    """
+    var_path, lat_path, lon_path = he5_paths(hemisphere, variable)
+    with h5py.File(he5_file, 'r') as f:
+        data = f[var_path][rows, cols].astype(np.float64)
+        if not geolocation:
+            return data
+        lat = f[lat_path][rows, cols].astype(np.float64)
+        lon = f[lon_path][rows, cols].astype(np.float64)
+    return data, lat, lon
+
+def mask_invalid(lat, lon, data=None, valid_range=None):
+    """
+    Mask, in place, the geolocation outside the projection (inf or fill values) as NaN, together with the data
+    at those pixels, and the data outside valid_range.
+
+    Args:
+        lat, lon (np.array): Float geolocation arrays.
+        data (np.array): Optional float data array of the same shape.
+        valid_range (tuple): Optional (min, max) of valid data (e.g., (0, 240) for SWE, whose codes above 240 are flags).
+
+    Returns:
+        np.array: Mask of the invalid geolocation.
+    """
+    with np.errstate(invalid='ignore'):
+        invalid = ~(np.abs(lat) <= 90) | ~(np.abs(lon) <= 180)
+        lat[invalid] = np.nan
+        lon[invalid] = np.nan
+        if data is not None:
+            data[invalid] = np.nan
+            if valid_range is not None:
+                data[(data < valid_range[0]) | (data > valid_range[1])] = np.nan
+    return invalid
+
+# Least recently used resampling plans (see resampling_plan), at most RESAMPLING_PLAN_CACHE_SIZE of them
+RESAMPLING_PLAN_CACHE_SIZE = 8
+_resampling_plans = OrderedDict()
+
+def clear_resampling_plans():
+    """
+    Remove the cached resampling plans.
+    """
+    _resampling_plans.clear()
+
+def resampling_plan(lon_target, lat_target, lon_input, lat_input, mag_factor=2):
+    """
+    Precompute the 'nearest' mapping of Data.Resampling (with its magnification) from an input grid to the target
+    grid, so that resampling a daily map is a gather and a bincount. The RESAMPLING_PLAN_CACHE_SIZE most recently
+    used plans are cached by grid content (see clear_resampling_plans).
+
+    Args:
+        lon_target, lat_target (np.array): 2D target grid (lat descending along rows, lon ascending along columns).
+        lon_input, lat_input (np.array): 2D input geolocation, with NaN outside the projection (see mask_invalid).
+        mag_factor (int): Magnification of the input before resampling (see Data.magnify_VAR).
+
+    Returns:
+        dict: 'source' (flat input index of each magnified pixel), 'target' (its flat target index) and 'shape'.
+    """
+    key = hashlib.sha1()
+    for array in (lon_target, lat_target, lon_input, lat_input):
+        key.update(str(array.shape).encode())
+        key.update(np.ascontiguousarray(array).tobytes())
+    key = (key.hexdigest(), mag_factor)
+    if key in _resampling_plans:
+        _resampling_plans.move_to_end(key)
+        return _resampling_plans[key]
+
+    source = np.arange(lat_input.size).reshape(lat_input.shape)
+    if mag_factor > 1:
+        lon_input = zoom(lon_input, mag_factor, order=1)
+        lat_input = zoom(lat_input, mag_factor, order=1)
+        source = zoom(source, mag_factor, order=0)
+
+    with np.errstate(invalid='ignore'):
+        valid = (lat_input <= np.max(lat_target[:, 0])) & (lat_input > np.min(lat_target[:, 0])) & \
+                (lon_input < np.max(lon_target[0, :])) & (lon_input >= np.min(lon_target[0, :]))
+
+    f_lat = interp1d(lat_target[:, 0], np.arange(lat_target.shape[0]), kind='nearest', bounds_error=False)
+    f_lon = interp1d(lon_target[0, :], np.arange(lon_target.shape[1]), kind='nearest', bounds_error=False)
+    t_lat_index = f_lat(lat_input[valid])
+    t_lon_index = f_lon(lon_input[valid])
+    inside = ~np.isnan(t_lat_index) & ~np.isnan(t_lon_index)
+
+    plan = {'source': source[valid][inside],
+            'target': np.ravel_multi_index((t_lat_index[inside].astype(int), t_lon_index[inside].astype(int)),
+                                           lat_target.shape),
+            'shape': lat_target.shape}
+    _resampling_plans[key] = plan
+    while len(_resampling_plans) > RESAMPLING_PLAN_CACHE_SIZE:
+        _resampling_plans.popitem(last=False)
+    return plan
+
+def read_he5_resampled(he5_file, plans, variable='SWE', valid_range=(0, 240)):
+    """
+    Read the daily variable of each hemisphere in plans from a .he5 file and average it on the target grid.
+
+    Args:
+        he5_file (str): Path to the .he5 file.
+        plans (dict): Resampling plan of each hemisphere (see resampling_plan).
+        variable (str): Variable prefix (e.g., 'SWE').
+        valid_range (tuple): (min, max) of valid data.
+
+    Returns:
+        np.array: Target grid mean of the hemispheres, NaN where there is no valid data.
+    """
+    shape = next(iter(plans.values()))['shape']
+    sums = np.zeros(np.prod(shape))
+    counts = np.zeros(np.prod(shape))
+    for hemisphere, plan in plans.items():
+        values = read_he5(he5_file, hemisphere, variable, geolocation=False).ravel()[plan['source']]
+        valid = (values >= valid_range[0]) & (values <= valid_range[1])
+        sums += np.bincount(plan['target'][valid], weights=values[valid], minlength=sums.size)
+        counts += np.bincount(plan['target'][valid], minlength=counts.size)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(counts > 0, sums / counts, np.nan).reshape(shape)
+
+def create_array_from_he5(file_list, data_doy, year, lon_target, lat_target, variable='SWE', hemispheres=('N', 'S'),
+                          valid_range=(0, 240), mag_factor=2, n_workers=4, prefetch=8, executor='process'):
+    """
+    Create a 3D array (lat, lon, doy_max + 1) of a daily AMSR-E/AMSR2 .he5 variable on the target grid in a single
+    parallel pass. The geolocation is read and masked once, from the first file, and turned into a cached
+    resampling plan per hemisphere (see resampling_plan); every file is then opened once and only its variable
+    is read. The hemispheres are averaged together where they overlap.
+
+    Args:
+        file_list (list): .he5 file paths (e.g., from extract_filelist_doy_he5).
+        data_doy (list): DOY of each file.
+        year (int): Year of the data.
+        lon_target, lat_target (np.array): 2D target grid (e.g., from Grid.generate_lon_lat_eqdgrid).
+        variable (str): Variable prefix (e.g., 'SWE').
+        hemispheres (tuple): Hemispheres to read ('N', 'S').
+        valid_range (tuple): (min, max) of valid data (SWE codes above 240 are flags).
+        mag_factor (int): Magnification of the input before resampling (see Data.Resampling).
+        n_workers, prefetch, executor: Reading pool (see Parallel_IO.prefetch_map).
+
+    Returns:
+        np.array: 3D array of the resampled data; days without a readable file are NaN.
+    """
+    plans = {}
+    for hemisphere in hemispheres:
+        _, lat_input, lon_input = read_he5(file_list[0], hemisphere, variable)
+        mask_invalid(lat_input, lon_input)
+        plans[hemisphere] = resampling_plan(lon_target, lat_target, lon_input, lat_input, mag_factor)
+
+    read_slice = partial(read_he5_resampled, plans=plans, variable=variable, valid_range=valid_range)
+    return create_array_from_slices(file_list, data_doy, year, read_slice,
+                                    n_workers=n_workers, prefetch=prefetch, executor=executor)
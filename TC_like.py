@@ -1,7 +1,48 @@
 import numpy as np
+import itertools
 import HydroAI.Vectorization as hVec
 
-def TCA(D1, D2, D3, nod_th=20, corr_th=0.1, REF=None):
+def CDF_match(DATA):
+    """
+    Rank-based CDF matching of one time series to a reference time series.
+
+    Parameters:
+    - DATA: 2D array of shape (time, 2); column 0 is the reference and column 1 the data to be matched.
+            Both columns are expected to be free of NaN values.
+
+    Returns:
+    - 1D array (time,) of the data mapped onto the reference distribution.
+    """
+    ref = np.sort(DATA[:, 0])
+    matched = np.empty_like(ref)
+    matched[np.argsort(DATA[:, 1], kind='stable')] = ref
+
+    return matched
+
+def CDF_match_vec(REF, D):
+    """
+    Rank-based CDF matching of D to REF for every pixel at once (vectorized version of CDF_match).
+    Assumes REF and D have the shape (lat, lon, time) and share the same NaN mask.
+
+    The n-th smallest value of D at a pixel is replaced by the n-th smallest value of REF at that pixel.
+    NaN values are sorted to the end of the time axis, so they stay NaN after the mapping.
+
+    Parameters:
+    - REF: Reference array with shape (lat, lon, time)
+    - D: Array to be matched with shape (lat, lon, time)
+
+    Returns:
+    - matched: Array with shape (lat, lon, time)
+    """
+    ref_sorted = np.sort(REF, axis=2)
+    order = np.argsort(D, axis=2, kind='stable')
+
+    matched = np.empty(D.shape, dtype=ref_sorted.dtype)
+    np.put_along_axis(matched, order, ref_sorted, axis=2)
+
+    return matched
+
+def TCA_forloop(D1, D2, D3, nod_th=20, corr_th=0.1, REF=None):
     
     avail_D1 = ~np.isnan(D1)
     avail_D2 = ~np.isnan(D2)
@@ -59,9 +100,9 @@ def TCA(D1, D2, D3, nod_th=20, corr_th=0.1, REF=None):
         else:
             inok = np.isnan(tmp)
             DATA[inok, :] = np.nan
-            X = CDF_match(np.column_stack((DATA[iok, 4], DATA[iok, 0])))
-            Y = CDF_match(np.column_stack((DATA[iok, 4], DATA[iok, 1])))
-            Z = CDF_match(np.column_stack((DATA[iok, 4], DATA[iok, 2])))
+            X = CDF_match(np.column_stack((DATA[iok, 3], DATA[iok, 0])))
+            Y = CDF_match(np.column_stack((DATA[iok, 3], DATA[iok, 1])))
+            Z = CDF_match(np.column_stack((DATA[iok, 3], DATA[iok, 2])))
 
         L = len(X)
         X = X.reshape((L, 1))
@@ -179,6 +220,128 @@ def TCA(D1, D2, D3, nod_th=20, corr_th=0.1, REF=None):
 
     return VAR_err, SNR, SNRdb, R, fMSE
 
+def TCA(D1, D2, D3, nod_th=20, corr_th=0.1, REF=None):
+    """
+    Vectorized triple collocation analysis with the same outputs and flag semantics as TCA_forloop.
+    Assumes D1, D2, D3 (and REF) have the shape (lat, lon, time). The inputs are not modified.
+
+    If REF is given, D1, D2 and D3 are CDF-matched to REF over the jointly valid time steps of each pixel
+    (CDF_match_vec) before the TC calculation.
+
+    Parameters:
+    - D1, D2, D3: Input arrays with shape (lat, lon, time)
+    - nod_th: Pixels need more than nod_th jointly valid time steps
+    - corr_th: Pixels with any pairwise correlation below corr_th are set to NaN
+    - REF: Optional reference array with shape (lat, lon, time)
+
+    Returns:
+    - VAR_err, SNR, SNRdb, R, fMSE: Dictionaries with 'x', 'y', 'z' keys of 2D (lat, lon) arrays
+    """
+    nan_mask = np.isnan(D1) | np.isnan(D2) | np.isnan(D3)
+    if REF is not None:
+        nan_mask |= np.isnan(REF)
+
+    n_valid = np.sum(~nan_mask, axis=2)
+    avail = (n_valid > nod_th) & (n_valid > 0)
+
+    X = np.where(nan_mask, np.nan, D1)
+    Y = np.where(nan_mask, np.nan, D2)
+    Z = np.where(nan_mask, np.nan, D3)
+
+    if REF is not None:
+        ref = np.where(nan_mask, np.nan, REF)
+        X = CDF_match_vec(ref, X)
+        Y = CDF_match_vec(ref, Y)
+        Z = CDF_match_vec(ref, Z)
+        ref = None
+    nan_mask = None
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # 1. covariance (ddof=0) and correlation of the (matched) data
+        Xc = X - np.nanmean(X, axis=2, keepdims=True)
+        Yc = Y - np.nanmean(Y, axis=2, keepdims=True)
+        Zc = Z - np.nanmean(Z, axis=2, keepdims=True)
+
+        covXX = np.nansum(Xc * Xc, axis=2) / n_valid
+        covYY = np.nansum(Yc * Yc, axis=2) / n_valid
+        covZZ = np.nansum(Zc * Zc, axis=2) / n_valid
+        covXY = np.nansum(Xc * Yc, axis=2) / n_valid
+        covXZ = np.nansum(Xc * Zc, axis=2) / n_valid
+        covYZ = np.nansum(Yc * Zc, axis=2) / n_valid
+        Xc = None; Yc = None; Zc = None
+
+        corrXY = covXY / np.sqrt(covXX * covYY)
+        corrXZ = covXZ / np.sqrt(covXX * covZZ)
+        corrYZ = covYZ / np.sqrt(covYY * covZZ)
+
+        # 2. scaling; the covariance of the scaled data follows from the unscaled covariance
+        c2 = np.nansum(X * Z, axis=2) / np.nansum(Y * Z, axis=2)
+        c3 = np.nansum(X * Y, axis=2) / np.nansum(Z * Y, axis=2)
+        X = None; Y = None; Z = None
+
+        XX = covXX
+        YY = c2 * c2 * covYY
+        ZZ = c3 * c3 * covZZ
+        XY = c2 * covXY
+        XZ = c3 * covXZ
+        YZ = c2 * c3 * covYZ
+
+        VAR_xerr = XX - XY * XZ / YZ
+        VAR_yerr = YY - XY * YZ / XZ
+        VAR_zerr = ZZ - XZ * YZ / XY
+
+        # flag on the number of samples and correlation (diagonal of the correlation matrix included)
+        condition_corr = (n_valid < nod_th) | (corrXY < corr_th) | (corrXZ < corr_th) | (corrYZ < corr_th) | (1 < corr_th)
+        VAR_xerr[condition_corr] = -1
+        VAR_yerr[condition_corr] = -1
+        VAR_zerr[condition_corr] = -1
+
+        # 3. TC numbers
+        NSR_x = VAR_xerr / (XY * XZ / YZ)
+        NSR_y = VAR_yerr / (XY * YZ / XZ)
+        NSR_z = VAR_zerr / (XZ * YZ / XY)
+        SNR_x = 1 / NSR_x
+        SNR_y = 1 / NSR_y
+        SNR_z = 1 / NSR_z
+
+        fMSE_x = 1 / (1 + SNR_x)
+        fMSE_y = 1 / (1 + SNR_y)
+        fMSE_z = 1 / (1 + SNR_z)
+
+        R_xx = 1 / (1 + NSR_x)
+        R_yy = 1 / (1 + NSR_y)
+        R_zz = 1 / (1 + NSR_z)
+
+        SNRdb_x = 10 * np.log10(SNR_x)
+        SNRdb_y = 10 * np.log10(SNR_y)
+        SNRdb_z = 10 * np.log10(SNR_z)
+
+    # flag on negative error variances
+    condition_negative_vars_err = (VAR_xerr < 0) | (VAR_yerr < 0) | (VAR_zerr < 0)
+    for arr in (fMSE_x, fMSE_y, fMSE_z, R_xx, R_yy, R_zz):
+        arr[condition_negative_vars_err] = -1
+    for arr in (SNR_x, SNR_y, SNR_z, SNRdb_x, SNRdb_y, SNRdb_z):
+        arr[condition_negative_vars_err] = np.nan
+
+    # flag on out-of-range R and fMSE (SNR is kept as in TCA_forloop)
+    condition_fMSE = ((R_xx < 0) | (R_yy < 0) | (fMSE_x < 0) | (fMSE_y < 0) |
+                      (R_xx > 1) | (R_yy > 1) | (fMSE_x > 1) | (fMSE_y > 1))
+    for arr in (R_xx, R_yy, R_zz, fMSE_x, fMSE_y, fMSE_z, SNRdb_x, SNRdb_y, SNRdb_z, VAR_xerr, VAR_yerr, VAR_zerr):
+        arr[condition_fMSE] = np.nan
+
+    # pixels without enough jointly valid data
+    for arr in (VAR_xerr, VAR_yerr, VAR_zerr, SNR_x, SNR_y, SNR_z, SNRdb_x, SNRdb_y, SNRdb_z,
+                R_xx, R_yy, R_zz, fMSE_x, fMSE_y, fMSE_z):
+        arr[~avail] = np.nan
+
+    VAR_err = {'x': VAR_xerr, 'y': VAR_yerr, 'z': VAR_zerr}
+    SNR = {'x': SNR_x, 'y': SNR_y, 'z': SNR_z}
+    SNRdb = {'x': SNRdb_x, 'y': SNRdb_y, 'z': SNRdb_z}
+    R = {'x': R_xx, 'y': R_yy, 'z': R_zz}
+    fMSE = {'x': fMSE_x, 'y': fMSE_y, 'z': fMSE_z}
+
+    return VAR_err, SNR, SNRdb, R, fMSE
+
 def TCA_vec(X, Y, Z, nod_th=30, corr_th=0):
 
     # 0. check the NaN and fill with NaN if any of X,Y, and Z value is nan.
@@ -187,86 +350,613 @@ def TCA_vec(X, Y, Z, nod_th=30, corr_th=0):
     Y[combined_nan_mask] = np.nan
     Z[combined_nan_mask] = np.nan
     
-    # 1. calculation for the originial data
-    # Calculate covariance
+    # 1. covariance of the original data
     cov_corr_results = hVec.cov_corr_three(X, Y, Z)
-    covXY = cov_corr_results.get('covXY')
-    covXZ = cov_corr_results.get('covXZ')
-    covYZ = cov_corr_results.get('covYZ')
-    
-    corrXY = cov_corr_results.get('corrXY')
-    corrXZ = cov_corr_results.get('corrXZ')
-    corrYZ = cov_corr_results.get('corrYZ')
-    
-    # 2. Vectorized TC calculation
-    # Scale the data
-    c1 = 1
+
+    # 2. scaling factors of Y and Z
     c2 = np.nansum(X*Z, axis=2) / np.nansum(Y*Z, axis=2)
     c3 = np.nansum(X*Y, axis=2) / np.nansum(Z*Y, axis=2)
-    
-    Xs = c1 * X
-    Ys = np.expand_dims(c2, axis=2) * Y
-    Zs = np.expand_dims(c3, axis=2) * Z
-    X=[]; Y=[]; Z=[];
-    
-    # Calculate covariance with scaled Xs, Ys, and Zs
-    cov_corr_results_s = hVec.cov_corr_three(Xs, Ys, Zs)
-    
-    covXXs = cov_corr_results_s.get('covXX')
-    covYYs = cov_corr_results_s.get('covYY')
-    covZZs = cov_corr_results_s.get('covZZ')
-    covXYs = cov_corr_results_s.get('covXY')
-    covXZs = cov_corr_results_s.get('covXZ')
-    covYZs = cov_corr_results_s.get('covYZ')
-    
-    # Calculate correlation with scaled Xs, Ys, and Zs
-    corrXYs = cov_corr_results_s.get('corrXYs')
-    corrXZs = cov_corr_results_s.get('corrXZs')
-    corrYZs = cov_corr_results_s.get('corrYZs')
-    
-    var_Xserr = covXXs - covXYs*covXZs/covYZs
-    var_Yserr = covYYs - covXYs*covYZs/covXZs
-    var_Zserr = covZZs - covXZs*covYZs/covXYs
-    
-    # Calcuate TC numbers
-    SNR_Xs =  (covXYs * covXZs / covYZs) / var_Xserr
-    SNR_Ys =  (covXYs * covYZs / covXZs) / var_Yserr
-    SNR_Zs =  (covXZs * covYZs / covXYs) / var_Zserr
-    
-    R_XYs = 1 / ((1 + 1/SNR_Xs) * (1 + 1/SNR_Ys)) ** 0.5
-    R_XZs = 1 / ((1 + 1/SNR_Xs) * (1 + 1/SNR_Zs)) ** 0.5
-    R_YZs = 1 / ((1 + 1/SNR_Ys) * (1 + 1/SNR_Zs)) ** 0.5
-    
-    fMSE_Xs = 1 / (1 + SNR_Xs)
-    fMSE_Ys = 1 / (1 + SNR_Ys)
-    fMSE_Zs = 1 / (1 + SNR_Zs)
-    
-    R_XXs = 1 / (1 + 1/SNR_Xs)
-    R_YYs = 1 / (1 + 1/SNR_Ys)
-    R_ZZs = 1 / (1 + 1/SNR_Zs)
-    
-    SNRdb_Xs = 10 * np.log10(SNR_Xs)
-    SNRdb_Ys = 10 * np.log10(SNR_Ys)
-    SNRdb_Zs = 10 * np.log10(SNR_Zs)
-    
+    n_valid = np.sum(~combined_nan_mask, axis=2)
+
+    # 3. TC numbers and flags (the covariances of the scaled data follow from the original ones)
+    return TCA_from_cov(cov_corr_results['covXX'], cov_corr_results['covYY'], cov_corr_results['covZZ'],
+                        cov_corr_results['covXY'], cov_corr_results['covXZ'], cov_corr_results['covYZ'],
+                        c2, c3, n_valid, nod_th, corr_th)
+
+def TCA_from_cov(covXX, covYY, covZZ, covXY, covXZ, covYZ, c2, c3, n_valid, nod_th=30, corr_th=0):
+    """
+    TC numbers and flags of TCA_vec, calculated from the (unscaled) covariances of X, Y, Z. This is the shared
+    core of TCA_vec and the moment-based variants (TCA_from_moments, TCAAccumulator, TCA_rolling, TCA_bootstrap).
+    All inputs are arrays of the same shape (e.g., (lat, lon)), so the calculation is O(1) per pixel.
+
+    Parameters:
+    - covXX, covYY, covZZ, covXY, covXZ, covYZ: Covariances of the unscaled data
+    - c2, c3: Scaling factors of Y and Z (c2 = sum(XZ)/sum(YZ), c3 = sum(XY)/sum(ZY))
+    - n_valid: Number of valid samples
+    - nod_th, corr_th: Thresholds used for the flags as in TCA_vec
+
+    Returns:
+    - VAR_err, SNR, SNRdb, R, fMSE, flags: Same as TCA_vec
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        corrXY = covXY / np.sqrt(covXX * covYY)
+        corrXZ = covXZ / np.sqrt(covXX * covZZ)
+        corrYZ = covYZ / np.sqrt(covYY * covZZ)
+
+        # covariance of the scaled data (X, c2*Y, c3*Z)
+        covXXs = covXX
+        covYYs = c2 * c2 * covYY
+        covZZs = c3 * c3 * covZZ
+        covXYs = c2 * covXY
+        covXZs = c3 * covXZ
+        covYZs = c2 * c3 * covYZ
+
+        var_Xserr = covXXs - covXYs*covXZs/covYZs
+        var_Yserr = covYYs - covXYs*covYZs/covXZs
+        var_Zserr = covZZs - covXZs*covYZs/covXYs
+
+        SNR_Xs = (covXYs * covXZs / covYZs) / var_Xserr
+        SNR_Ys = (covXYs * covYZs / covXZs) / var_Yserr
+        SNR_Zs = (covXZs * covYZs / covXYs) / var_Zserr
+
+        fMSE_Xs = 1 / (1 + SNR_Xs)
+        fMSE_Ys = 1 / (1 + SNR_Ys)
+        fMSE_Zs = 1 / (1 + SNR_Zs)
+
+        R_XXs = 1 / (1 + 1/SNR_Xs)
+        R_YYs = 1 / (1 + 1/SNR_Ys)
+        R_ZZs = 1 / (1 + 1/SNR_Zs)
+
+        SNRdb_Xs = 10 * np.log10(SNR_Xs)
+        SNRdb_Ys = 10 * np.log10(SNR_Ys)
+        SNRdb_Zs = 10 * np.log10(SNR_Zs)
+
     VAR_err = {'x': var_Xserr, 'y': var_Yserr, 'z': var_Zserr}
     SNR = {'x': SNR_Xs, 'y': SNR_Ys, 'z': SNR_Zs}
     SNRdb = {'x': SNRdb_Xs, 'y': SNRdb_Ys, 'z': SNRdb_Zs}
     R = {'x': R_XXs, 'y': R_YYs, 'z': R_ZZs}
     fMSE = {'x': fMSE_Xs, 'y': fMSE_Ys, 'z': fMSE_Zs}
-    
-    # 3. set the flags
-    # flag on non-scaled data
+
     condition_corr = (corrXY < corr_th) | (corrXZ < corr_th) | (corrYZ < corr_th) #flag 1
-    
-    # falg on scaled data
-    condition_n_valid = np.sum(~np.isnan(Xs) & ~np.isnan(Ys) & ~np.isnan(Zs), axis=2) < nod_th #flag 2
+    condition_n_valid = n_valid < nod_th #flag 2
     condition_fMSE = (fMSE_Xs < 0) | (fMSE_Ys < 0) | (fMSE_Zs < 0) | (fMSE_Xs > 1) | (fMSE_Ys > 1) | (fMSE_Zs > 1) #flag 3
-    condition_negative_vars_err  = (var_Xserr < 0) | (var_Yserr < 0) | (var_Zserr < 0) #flag 4
-    
-    flags = {'condition_corr': condition_corr, 
+    condition_negative_vars_err = (var_Xserr < 0) | (var_Yserr < 0) | (var_Zserr < 0) #flag 4
+
+    flags = {'condition_corr': condition_corr,
             'condition_n_valid': condition_n_valid,
             'condition_fMSE': condition_fMSE,
             'condition_negative_vars_err': condition_negative_vars_err}
 
     return VAR_err, SNR, SNRdb, R, fMSE, flags
+
+def pairwise_moments(datasets, row_chunk=100, time_chunk=32):
+    """
+    Pairwise joint-valid moments of N datasets, calculated per pixel in one streaming pass over the data.
+    Each dataset has the shape (lat, lon, time); any sliceable array (np.memmap, netCDF4 variable) can be used.
+
+    For every pair (i, j) only the time steps where both dataset i and dataset j are valid are used:
+    - count[..., i, j]: number of jointly valid samples
+    - sum[..., i, j]:   sum of dataset i
+    - sumsq[..., i, j]: sum of dataset i squared
+    - cross[..., i, j]: sum of dataset i * dataset j
+
+    Parameters:
+    - datasets: List of N arrays with shape (lat, lon, time)
+    - row_chunk: Number of rows (lat) processed at once
+    - time_chunk: Number of time steps processed at once
+
+    Returns:
+    - moments: Dictionary of the arrays above, each with shape (lat, lon, N, N)
+    """
+    n_data = len(datasets)
+    n_lat, n_lon, n_time = datasets[0].shape
+    for data in datasets[1:]:
+        if data.shape != datasets[0].shape:
+            raise ValueError(f"All datasets should have the same shape: {datasets[0].shape} and {data.shape}")
+
+    moments = {'count': np.zeros((n_lat, n_lon, n_data, n_data), dtype=np.int32),
+               'sum': np.zeros((n_lat, n_lon, n_data, n_data)),
+               'sumsq': np.zeros((n_lat, n_lon, n_data, n_data)),
+               'cross': np.zeros((n_lat, n_lon, n_data, n_data))}
+
+    for r0 in range(0, n_lat, row_chunk):
+        rows = slice(r0, r0 + row_chunk)
+        for t0 in range(0, n_time, time_chunk):
+            # (rows, lon, N, time_chunk)
+            chunk = np.stack([np.asarray(data[rows, :, t0:t0 + time_chunk], dtype=np.float64) for data in datasets], axis=2)
+            valid = ~np.isnan(chunk)
+            v = valid.astype(np.float64)
+            x = np.where(valid, chunk, 0)
+
+            moments['count'][rows] += np.einsum('abit,abjt->abij', v, v).astype(np.int32)
+            moments['sum'][rows] += np.einsum('abit,abjt->abij', x, v)
+            moments['sumsq'][rows] += np.einsum('abit,abjt->abij', x * x, v)
+            moments['cross'][rows] += np.einsum('abit,abjt->abij', x, x)
+
+    return moments
+
+def TCA_from_moments(moments, i, j, k, nod_th=30, corr_th=0):
+    """
+    TCA_vec outputs for the triplet (X, Y, Z) = (dataset i, dataset j, dataset k) from pairwise_moments.
+
+    Covariances use the jointly valid samples of each pair (ddof=1 as in TCA_vec); the variance of a dataset
+    is the average of its variances over the two pairs it belongs to. When the three datasets share the
+    same valid time steps, the results equal those of TCA_vec.
+
+    Parameters:
+    - moments: Output of pairwise_moments
+    - i, j, k: Indices of the datasets used as X, Y, Z
+    - nod_th, corr_th: Thresholds used for the flags as in TCA_vec
+
+    Returns:
+    - VAR_err, SNR, SNRdb, R, fMSE, flags: Same as TCA_vec
+    """
+    count = moments['count']
+    s = moments['sum']
+    ss = moments['sumsq']
+    cross = moments['cross']
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        def cov(a, b):
+            n = count[..., a, b]
+            return (cross[..., a, b] - s[..., a, b] * s[..., b, a] / n) / (n - 1)
+
+        def var(a, b):
+            n = count[..., a, b]
+            return (ss[..., a, b] - s[..., a, b] ** 2 / n) / (n - 1)
+
+        covXX = (var(i, j) + var(i, k)) / 2
+        covYY = (var(j, i) + var(j, k)) / 2
+        covZZ = (var(k, i) + var(k, j)) / 2
+
+        c2 = cross[..., i, k] / cross[..., j, k]
+        c3 = cross[..., i, j] / cross[..., k, j]
+
+    n_valid = np.minimum(np.minimum(count[..., i, j], count[..., i, k]), count[..., j, k])
+
+    return TCA_from_cov(covXX, covYY, covZZ, cov(i, j), cov(i, k), cov(j, k), c2, c3, n_valid, nod_th, corr_th)
+
+def TCA_all_triplets(moments, names=None, nod_th=30, corr_th=0):
+    """
+    TCA for every triplet of the datasets in pairwise_moments (e.g., 20 triplets for 6 products).
+
+    Parameters:
+    - moments: Output of pairwise_moments
+    - names: Optional list of dataset names; indices are used if None
+    - nod_th, corr_th: Thresholds used for the flags as in TCA_vec
+
+    Returns:
+    - results: Dictionary {(name_x, name_y, name_z): (VAR_err, SNR, SNRdb, R, fMSE, flags)}
+    """
+    n_data = moments['count'].shape[-1]
+    if names is None:
+        names = list(range(n_data))
+
+    results = {}
+    for i, j, k in itertools.combinations(range(n_data), 3):
+        results[(names[i], names[j], names[k])] = TCA_from_moments(moments, i, j, k, nod_th, corr_th)
+
+    return results
+
+def select_best_triplet(results, name, criterion='R', apply_flags=True):
+    """
+    Select, per pixel, the triplet giving the best TC estimate for one dataset.
+
+    Parameters:
+    - results: Output of TCA_all_triplets
+    - name: Name of the dataset to evaluate
+    - criterion: 'R' (largest), 'SNR' (largest), or 'VAR_err' (smallest)
+    - apply_flags: If True, flagged pixels of a triplet are not selected
+
+    Returns:
+    - best: 2D array of the selected criterion values (NaN if no triplet is available)
+    - best_index: 2D array of indices into triplets (-1 if no triplet is available)
+    - triplets: List of triplets containing the dataset
+    """
+    outputs = {'VAR_err': 0, 'SNR': 1, 'R': 3}
+    if criterion not in outputs:
+        raise ValueError("criterion should be 'R', 'SNR', or 'VAR_err'")
+
+    triplets = [triplet for triplet in results if name in triplet]
+    if len(triplets) == 0:
+        raise ValueError(f"No triplet contains {name}")
+
+    values = []
+    for triplet in triplets:
+        key = 'xyz'[triplet.index(name)]
+        value = np.array(results[triplet][outputs[criterion]][key], dtype=np.float64)
+        if apply_flags:
+            flags = results[triplet][5]
+            value[np.any([flag for flag in flags.values()], axis=0)] = np.nan
+        values.append(-value if criterion == 'VAR_err' else value)
+    values = np.stack(values, axis=-1)
+
+    no_triplet = np.all(np.isnan(values), axis=-1)
+    best_index = np.argmax(np.where(np.isnan(values), -np.inf, values), axis=-1)
+    best = np.take_along_axis(values, best_index[..., np.newaxis], axis=-1)[..., 0]
+    if criterion == 'VAR_err':
+        best = -best
+
+    best_index[no_triplet] = -1
+    best[no_triplet] = np.nan
+
+    return best, best_index, triplets
+
+def TCA_bootstrap(X, Y, Z, n_boot=500, ci=95, nod_th=30, corr_th=0, boot_chunk=50, pixel_chunk=2000, seed=None):
+    """
+    Bootstrap percentile confidence intervals of the TCA_vec metrics (VAR_err, SNR, R).
+    Assumes X, Y, Z have the shape (lat, lon, time). The inputs are not modified.
+
+    Time indices are resampled with replacement, and the same resamples are used for all pixels.
+    A resample is represented by how many times each time step is drawn, so the sufficient statistics
+    (sums and cross products) of all replicates in a chunk are obtained with one matrix product.
+    Replicates flagged by TCA_vec's conditions are excluded from the intervals.
+    Memory is bounded by pixel_chunk x n_boot values per metric.
+
+    Parameters:
+    - X, Y, Z: Input arrays with shape (lat, lon, time)
+    - n_boot: Number of bootstrap replicates
+    - ci: Confidence level in percent
+    - nod_th, corr_th: Thresholds used for the flags as in TCA_vec
+    - boot_chunk: Number of replicates evaluated at once
+    - pixel_chunk: Number of pixels evaluated at once
+    - seed: Seed (or np.random.Generator) for the resampling
+
+    Returns:
+    - CI_lower, CI_upper: Dictionaries {'VAR_err', 'SNR', 'R'} of dictionaries with 'x', 'y', 'z' keys of 2D arrays
+    """
+    rng = np.random.default_rng(seed)
+    n_lat, n_lon, n_time = X.shape
+    q = [(100 - ci) / 2, 100 - (100 - ci) / 2]
+
+    # resampling weights shared by all pixels: weights[b, t] = number of times t is drawn in replicate b
+    draws = rng.integers(0, n_time, size=(n_boot, n_time))
+    weights = np.zeros((n_boot, n_time))
+    np.add.at(weights, (np.arange(n_boot)[:, np.newaxis], draws), 1)
+    draws = None
+
+    X_2d = X.reshape(-1, n_time)
+    Y_2d = Y.reshape(-1, n_time)
+    Z_2d = Z.reshape(-1, n_time)
+    valid = ~(np.isnan(X_2d) | np.isnan(Y_2d) | np.isnan(Z_2d))
+    pixels = np.where(np.sum(valid, axis=1) > 2)[0]
+
+    metrics = ['VAR_err', 'SNR', 'R']
+    CI_lower = {m: {k: np.full(n_lat * n_lon, np.nan) for k in 'xyz'} for m in metrics}
+    CI_upper = {m: {k: np.full(n_lat * n_lon, np.nan) for k in 'xyz'} for m in metrics}
+
+    for p0 in range(0, pixels.size, pixel_chunk):
+        p_idx = pixels[p0:p0 + pixel_chunk]
+        v = valid[p_idx]
+        x = np.where(v, X_2d[p_idx], 0).astype(np.float64)
+        y = np.where(v, Y_2d[p_idx], 0).astype(np.float64)
+        z = np.where(v, Z_2d[p_idx], 0).astype(np.float64)
+        # (n_terms, pixels, time)
+        terms = np.stack([v.astype(np.float64), x, y, z, x*x, y*y, z*z, x*y, x*z, y*z])
+
+        boot = {m: {k: np.full((p_idx.size, n_boot), np.nan) for k in 'xyz'} for m in metrics}
+
+        for b0 in range(0, n_boot, boot_chunk):
+            w = weights[b0:b0 + boot_chunk]
+            n, Sx, Sy, Sz, Sxx, Syy, Szz, Sxy, Sxz, Syz = terms @ w.T
+
+            with np.errstate(divide='ignore', invalid='ignore'):
+                covXX = (Sxx - Sx*Sx/n) / (n - 1)
+                covYY = (Syy - Sy*Sy/n) / (n - 1)
+                covZZ = (Szz - Sz*Sz/n) / (n - 1)
+                covXY = (Sxy - Sx*Sy/n) / (n - 1)
+                covXZ = (Sxz - Sx*Sz/n) / (n - 1)
+                covYZ = (Syz - Sy*Sz/n) / (n - 1)
+                c2 = Sxz / Syz
+                c3 = Sxy / Syz
+
+            VAR_err, SNR, SNRdb, R, fMSE, flags = TCA_from_cov(covXX, covYY, covZZ, covXY, covXZ, covYZ,
+                                                               c2, c3, n, nod_th, corr_th)
+            flagged = np.any([flag for flag in flags.values()], axis=0)
+
+            for m, result in zip(metrics, [VAR_err, SNR, R]):
+                for k in 'xyz':
+                    boot[m][k][:, b0:b0 + boot_chunk] = np.where(flagged, np.nan, result[k])
+
+        for m in metrics:
+            for k in 'xyz':
+                has_boot = ~np.all(np.isnan(boot[m][k]), axis=1)
+                lower, upper = np.nanpercentile(boot[m][k][has_boot], q, axis=1)
+                CI_lower[m][k][p_idx[has_boot]] = lower
+                CI_upper[m][k][p_idx[has_boot]] = upper
+
+    for m in metrics:
+        for k in 'xyz':
+            CI_lower[m][k] = CI_lower[m][k].reshape(n_lat, n_lon)
+            CI_upper[m][k] = CI_upper[m][k].reshape(n_lat, n_lon)
+
+    return CI_lower, CI_upper
+
+class TCAAccumulator:
+    """
+    Per-pixel running counts, means and co-moments of three products for online TCA.
+
+    update() adds new time steps in O(lat x lon) per time step (Welford), merge() combines accumulators
+    built from different workers or periods (Chan et al.), and finalize() returns the outputs of TCA_vec.
+    Only the time steps where all three products are valid are used, as in TCA_vec.
+
+    Example:
+    acc = TCAAccumulator((n_lat, n_lon))
+    for doy in range(X.shape[2]):
+        acc.update(X[:, :, doy], Y[:, :, doy], Z[:, :, doy])
+    VAR_err, SNR, SNRdb, R, fMSE, flags = acc.finalize()
+    """
+    pairs = ['xx', 'yy', 'zz', 'xy', 'xz', 'yz']
+
+    def __init__(self, shape):
+        self.shape = tuple(shape)
+        self.n = np.zeros(self.shape, dtype=np.int64)
+        self.mean = {k: np.zeros(self.shape) for k in 'xyz'}
+        self.comoment = {p: np.zeros(self.shape) for p in self.pairs}
+
+    def update(self, x, y, z):
+        """
+        Add one time step ((lat, lon) arrays) or a block of time steps ((lat, lon, time) arrays).
+        """
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        z = np.asarray(z, dtype=np.float64)
+
+        if x.ndim == len(self.shape) + 1:
+            for t in range(x.shape[-1]):
+                self.update(x[..., t], y[..., t], z[..., t])
+            return self
+
+        valid = ~(np.isnan(x) | np.isnan(y) | np.isnan(z))
+        self.n += valid
+
+        values = {'x': x, 'y': y, 'z': z}
+        delta_old = {}
+        delta_new = {}
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for k in 'xyz':
+                delta = np.where(valid, values[k] - self.mean[k], 0)
+                delta_old[k] = delta
+                self.mean[k] += np.where(valid, delta / self.n, 0)
+                delta_new[k] = np.where(valid, values[k] - self.mean[k], 0)
+
+        for p in self.pairs:
+            self.comoment[p] += delta_old[p[0]] * delta_new[p[1]]
+
+        return self
+
+    def merge(self, other):
+        """
+        Combine the statistics of another TCAAccumulator with the same shape into this one.
+        """
+        if other.shape != self.shape:
+            raise ValueError(f"Shapes of the accumulators do not match: {self.shape} and {other.shape}")
+
+        n = self.n + other.n
+        with np.errstate(divide='ignore', invalid='ignore'):
+            weight = np.where(n > 0, other.n / n, 0)
+            factor = np.where(n > 0, self.n * other.n / n, 0)
+
+        delta = {k: other.mean[k] - self.mean[k] for k in 'xyz'}
+        for p in self.pairs:
+            self.comoment[p] += other.comoment[p] + delta[p[0]] * delta[p[1]] * factor
+        for k in 'xyz':
+            self.mean[k] += delta[k] * weight
+        self.n = n
+
+        return self
+
+    def finalize(self, nod_th=30, corr_th=0):
+        """
+        Return VAR_err, SNR, SNRdb, R, fMSE, flags as in TCA_vec.
+        """
+        n = self.n
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cov = {p: np.where(n > 1, self.comoment[p] / (n - 1), np.nan) for p in self.pairs}
+
+            # uncentered sums of the cross products for the scaling factors
+            cross = {p: self.comoment[p] + n * self.mean[p[0]] * self.mean[p[1]] for p in ['xy', 'xz', 'yz']}
+            c2 = cross['xz'] / cross['yz']
+            c3 = cross['xy'] / cross['yz']
+
+        return TCA_from_cov(cov['xx'], cov['yy'], cov['zz'], cov['xy'], cov['xz'], cov['yz'],
+                            c2, c3, n, nod_th, corr_th)
+
+def TCA_rolling(X, Y, Z, window, step=1, nod_th=30, corr_th=0):
+    """
+    Moving-window TCA along the time axis (e.g., seasonal, time-varying error maps).
+    Assumes X, Y, Z have the shape (lat, lon, time). The inputs are not modified.
+
+    Window k covers the time steps [k*step, k*step + window). The sums of the jointly valid data and their
+    cross products are updated by adding the time steps entering the window and removing the ones leaving it,
+    so the whole series costs about one pass over the data. The data are shifted by their per-pixel mean
+    before the sums are accumulated to keep the updates numerically stable.
+
+    Parameters:
+    - X, Y, Z: Input arrays with shape (lat, lon, time)
+    - window: Window length in time steps
+    - step: Number of time steps between the starts of consecutive windows
+    - nod_th, corr_th: Thresholds used for the flags as in TCA_vec (applied per window)
+
+    Returns:
+    - VAR_err, SNR, SNRdb, R, fMSE, flags: Same as TCA_vec, with arrays of shape (lat, lon, n_windows)
+    """
+    n_lat, n_lon, n_time = X.shape
+    if window > n_time:
+        raise ValueError(f"window ({window}) is longer than the time axis ({n_time})")
+    n_windows = (n_time - window) // step + 1
+
+    with np.errstate(invalid='ignore'):
+        valid_all = ~(np.isnan(X) | np.isnan(Y) | np.isnan(Z))
+        shift = {k: np.nan_to_num(np.nanmean(np.where(valid_all, D, np.nan), axis=2))
+                 for k, D in zip('xyz', (X, Y, Z))}
+    valid_all = None
+
+    terms = ['n', 'x', 'y', 'z', 'xx', 'yy', 'zz', 'xy', 'xz', 'yz']
+
+    def day_terms(t):
+        valid = ~(np.isnan(X[:, :, t]) | np.isnan(Y[:, :, t]) | np.isnan(Z[:, :, t]))
+        v = {k: np.where(valid, D[:, :, t] - shift[k], 0) for k, D in zip('xyz', (X, Y, Z))}
+        return np.stack([valid.astype(np.float64), v['x'], v['y'], v['z'],
+                         v['x']*v['x'], v['y']*v['y'], v['z']*v['z'],
+                         v['x']*v['y'], v['x']*v['z'], v['y']*v['z']])
+
+    keys = ['VAR_err', 'SNR', 'SNRdb', 'R', 'fMSE']
+    outputs = {m: {k: np.full((n_lat, n_lon, n_windows), np.nan) for k in 'xyz'} for m in keys}
+    flag_names = ['condition_corr', 'condition_n_valid', 'condition_fMSE', 'condition_negative_vars_err']
+    flags = {f: np.zeros((n_lat, n_lon, n_windows), dtype=bool) for f in flag_names}
+
+    sums = np.zeros((len(terms), n_lat, n_lon))
+    for t in range(window):
+        sums += day_terms(t)
+
+    for w in range(n_windows):
+        if w > 0:
+            start, end = w * step, w * step + window
+            prev_start, prev_end = start - step, end - step
+            for t in range(prev_start, min(start, prev_end)):
+                sums -= day_terms(t)
+            for t in range(max(prev_end, start), end):
+                sums += day_terms(t)
+
+        S = dict(zip(terms, sums))
+        n = np.rint(S['n'])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cov = {p: (S[p] - S[p[0]] * S[p[1]] / n) / (n - 1) for p in ['xx', 'yy', 'zz', 'xy', 'xz', 'yz']}
+            # uncentered sums of the cross products for the scaling factors
+            cross = {p: S[p] + shift[p[0]] * S[p[1]] + shift[p[1]] * S[p[0]] + n * shift[p[0]] * shift[p[1]]
+                     for p in ['xy', 'xz', 'yz']}
+            c2 = cross['xz'] / cross['yz']
+            c3 = cross['xy'] / cross['yz']
+
+        results = TCA_from_cov(cov['xx'], cov['yy'], cov['zz'], cov['xy'], cov['xz'], cov['yz'],
+                               c2, c3, n, nod_th, corr_th)
+        for m, result in zip(keys, results[:5]):
+            for k in 'xyz':
+                outputs[m][k][:, :, w] = result[k]
+        for f in flag_names:
+            flags[f][:, :, w] = results[5][f]
+
+    return outputs['VAR_err'], outputs['SNR'], outputs['SNRdb'], outputs['R'], outputs['fMSE'], flags
+
+def moments_to_cov(moments):
+    """
+    Per-pixel covariance matrices (ddof=1) of N datasets from pairwise_moments.
+
+    Off-diagonal elements use the jointly valid samples of each pair, and the variance of a dataset is
+    the average of its variances over all pairs it belongs to.
+
+    Parameters:
+    - moments: Output of pairwise_moments
+
+    Returns:
+    - cov: Array with shape (lat, lon, N, N)
+    """
+    n = moments['count'].astype(np.float64)
+    s = moments['sum']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cov = (moments['cross'] - s * np.swapaxes(s, -1, -2) / n) / (n - 1)
+        var_pair = (moments['sumsq'] - s ** 2 / n) / (n - 1)
+
+    n_data = n.shape[-1]
+    off_diagonal = ~np.eye(n_data, dtype=bool)
+    with np.errstate(invalid='ignore'):
+        variance = np.nanmean(np.where(off_diagonal, var_pair, np.nan), axis=-1)
+    cov[..., np.arange(n_data), np.arange(n_data)] = variance
+
+    return cov
+
+def EC_from_cov(cov, n_valid=None, names=None, reference=0, nod_th=30, corr_th=0, pixel_chunk=100000):
+    """
+    Extended collocation (EC) of N >= 3 products from their per-pixel covariance matrices.
+
+    With x_i = a_i + b_i * truth + e_i, the off-diagonal covariances are Q_ij = beta_i * beta_j with
+    beta_i = b_i * std(truth). Taking logarithms gives the linear system log(Q_ij) = log(beta_i) + log(beta_j),
+    which is overdetermined for N > 3. It is solved in the least-squares sense for all pixels at once with
+    the pseudo-inverse of the (pixel-independent) design matrix. For N = 3, SNR, R and fMSE equal those of
+    TCA_vec. VAR_err of the non-reference products does not: it is rescaled with the covariance ratios
+    (beta_ref / beta_i)^2, whereas TCA_vec scales Y and Z with ratios of uncentered moments (sum(X*Z) / sum(Y*Z)).
+
+    Parameters:
+    - cov: Covariance matrices with shape (lat, lon, N, N) (e.g., from moments_to_cov)
+    - n_valid: Optional 2D array of the number of valid samples (used for the flag on nod_th)
+    - names: Optional list of product names; indices are used if None
+    - reference: Index of the product whose units are used for VAR_err (as X in TCA_vec)
+    - nod_th, corr_th: Thresholds used for the flags
+    - pixel_chunk: Number of pixels solved at once
+
+    Returns:
+    - VAR_err, SNR, SNRdb, R, fMSE: Dictionaries with product names as keys of 2D arrays
+    - flags: Dictionary of boolean 2D arrays
+    """
+    n_lat, n_lon, n_data = cov.shape[0], cov.shape[1], cov.shape[-1]
+    if n_data < 3:
+        raise ValueError("At least three products are needed for collocation analysis.")
+    if names is None:
+        names = list(range(n_data))
+
+    pairs = list(itertools.combinations(range(n_data), 2))
+    design = np.zeros((len(pairs), n_data))
+    for p, (i, j) in enumerate(pairs):
+        design[p, i] = 1
+        design[p, j] = 1
+    solver = np.linalg.pinv(design)  # (N, n_pairs)
+
+    Q = cov.reshape(-1, n_data, n_data)
+    Q_pairs = np.stack([Q[:, i, j] for i, j in pairs], axis=1)  # (pixels, n_pairs)
+    Q_diag = np.stack([Q[:, i, i] for i in range(n_data)], axis=1)  # (pixels, N)
+
+    signal = np.full((Q.shape[0], n_data), np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for p0 in range(0, Q.shape[0], pixel_chunk):
+            log_Q = np.log(Q_pairs[p0:p0 + pixel_chunk])
+            log_beta = log_Q @ solver.T
+            signal[p0:p0 + pixel_chunk] = np.exp(2 * log_beta)
+
+        corr = np.stack([Q[:, i, j] / np.sqrt(Q[:, i, i] * Q[:, j, j]) for i, j in pairs], axis=1)
+
+        VAR_err_own = Q_diag - signal
+        SNR_all = signal / VAR_err_own
+        R_all = signal / Q_diag
+        fMSE_all = VAR_err_own / Q_diag
+        SNRdb_all = 10 * np.log10(SNR_all)
+        # error variance in the units of the reference product
+        VAR_err_all = VAR_err_own * signal[:, [reference]] / signal
+
+    shape = (n_lat, n_lon)
+    VAR_err = {name: VAR_err_all[:, i].reshape(shape) for i, name in enumerate(names)}
+    SNR = {name: SNR_all[:, i].reshape(shape) for i, name in enumerate(names)}
+    SNRdb = {name: SNRdb_all[:, i].reshape(shape) for i, name in enumerate(names)}
+    R = {name: R_all[:, i].reshape(shape) for i, name in enumerate(names)}
+    fMSE = {name: fMSE_all[:, i].reshape(shape) for i, name in enumerate(names)}
+
+    with np.errstate(invalid='ignore'):
+        condition_corr = np.any(corr < corr_th, axis=1).reshape(shape) #flag 1
+        condition_n_valid = (n_valid < nod_th) if n_valid is not None else np.zeros(shape, dtype=bool) #flag 2
+        condition_fMSE = np.any((fMSE_all < 0) | (fMSE_all > 1), axis=1).reshape(shape) #flag 3
+        condition_negative_vars_err = np.any(VAR_err_own < 0, axis=1).reshape(shape) #flag 4
+        condition_negative_cov = np.any(Q_pairs <= 0, axis=1).reshape(shape) #flag 5 (no log solution)
+
+    flags = {'condition_corr': condition_corr,
+            'condition_n_valid': condition_n_valid,
+            'condition_fMSE': condition_fMSE,
+            'condition_negative_vars_err': condition_negative_vars_err,
+            'condition_negative_cov': condition_negative_cov}
+
+    return VAR_err, SNR, SNRdb, R, fMSE, flags
+
+def EC(datasets, names=None, reference=0, nod_th=30, corr_th=0, row_chunk=100, time_chunk=32, pixel_chunk=100000):
+    """
+    Extended collocation of N >= 3 datasets with shape (lat, lon, time).
+    The covariance matrices are built in one streaming pass (pairwise_moments) and solved with EC_from_cov.
+
+    Returns:
+    - VAR_err, SNR, SNRdb, R, fMSE, flags: Same as EC_from_cov
+    """
+    moments = pairwise_moments(datasets, row_chunk=row_chunk, time_chunk=time_chunk)
+    count = moments['count']
+    n_data = count.shape[-1]
+    off_diagonal = ~np.eye(n_data, dtype=bool)
+    n_valid = np.min(np.where(off_diagonal, count, np.iinfo(count.dtype).max), axis=(-2, -1))
+
+    return EC_from_cov(moments_to_cov(moments), n_valid, names, reference, nod_th, corr_th, pixel_chunk)
@@ -1,4 +1,5 @@
 import numpy as np
+from scipy import stats
 
 def covariance(X, Y):
     """
@@ -202,4 +203,106 @@ def cov_corr_three(X, Y, Z, calc_cov=True, calc_corr=True):
         results['corrYZ'][valid_mask.reshape(original_shape)] = corrYZ
         results['corrXZ'][valid_mask.reshape(original_shape)] = corrXZ
 
-    return results
\ No newline at end of file
+    return results
+
+def metrics(X, Y, metric_list=None, X_clim=None, Y_clim=None, chunk_size=100):
+    """
+    Calculate validation metrics between an estimate X and a reference Y for every pixel, ignoring NaN values.
+    Assumes X and Y have the shape (lat, lon, time). Only the time steps where both X and Y are valid are used.
+
+    All requested metrics are derived from the same per-chunk statistics (count, means, centered
+    (co)variances, error sums), so the data are read once per chunk of rows. Inputs may be float32;
+    the statistics are accumulated in float64.
+
+    Available metrics:
+    - 'bias': mean(X - Y)
+    - 'RMSE': sqrt(mean((X - Y)^2))
+    - 'ubRMSE': sqrt(RMSE^2 - bias^2)
+    - 'MAE': mean(|X - Y|)
+    - 'R': Pearson correlation
+    - 'NSE': Nash-Sutcliffe efficiency of X with respect to Y
+    - 'KGE': Kling-Gupta efficiency, 1 - sqrt((R-1)^2 + (std(X)/std(Y)-1)^2 + (mean(X)/mean(Y)-1)^2)
+    - 'anomaly_R': Pearson correlation of X - X_clim and Y - Y_clim (requires X_clim and Y_clim)
+    - 'spearman': Spearman rank correlation (average ranks of the jointly valid samples)
+
+    Parameters:
+    - X, Y: Input arrays with shape (lat, lon, time)
+    - metric_list: List of metric names; all metrics (except anomaly_R without climatologies) if None
+    - X_clim, Y_clim: Climatologies with shape (lat, lon, time) used for anomaly_R
+    - chunk_size: Number of rows (lat) processed at once
+
+    Returns:
+    - results: Dictionary of 2D (lat, lon) arrays
+    """
+    available = ['bias', 'RMSE', 'ubRMSE', 'MAE', 'R', 'NSE', 'KGE', 'anomaly_R', 'spearman']
+    if metric_list is None:
+        metric_list = [m for m in available if m != 'anomaly_R' or (X_clim is not None and Y_clim is not None)]
+    for m in metric_list:
+        if m not in available:
+            raise ValueError(f"Unknown metric: {m}. Available metrics: {available}")
+    if 'anomaly_R' in metric_list and (X_clim is None or Y_clim is None):
+        raise ValueError("X_clim and Y_clim are needed for anomaly_R")
+
+    results = {m: np.full(X.shape[:2], np.nan) for m in metric_list}
+
+    for i in range(0, X.shape[0], chunk_size):
+        s = slice(i, i + chunk_size)
+        x = np.asarray(X[s], dtype=np.float64)
+        y = np.asarray(Y[s], dtype=np.float64)
+        valid = ~(np.isnan(x) | np.isnan(y))
+        x = np.where(valid, x, np.nan)
+        y = np.where(valid, y, np.nan)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # shared statistics
+            n = np.sum(valid, axis=2)
+            mean_x = np.nansum(x, axis=2) / n
+            mean_y = np.nansum(y, axis=2) / n
+            dx = x - mean_x[:, :, np.newaxis]
+            dy = y - mean_y[:, :, np.newaxis]
+            var_x = np.nansum(dx * dx, axis=2) / n
+            var_y = np.nansum(dy * dy, axis=2) / n
+            cov_xy = np.nansum(dx * dy, axis=2) / n
+            corr = cov_xy / np.sqrt(var_x * var_y)
+            bias = mean_x - mean_y
+            # mean squared error from the centered statistics: var(X - Y) + bias^2
+            var_err = np.maximum(var_x + var_y - 2 * cov_xy, 0)
+            mse = var_err + bias * bias
+
+            chunk_results = {}
+            for m in metric_list:
+                if m == 'bias':
+                    chunk_results[m] = bias
+                elif m == 'RMSE':
+                    chunk_results[m] = np.sqrt(mse)
+                elif m == 'ubRMSE':
+                    chunk_results[m] = np.sqrt(var_err)
+                elif m == 'MAE':
+                    chunk_results[m] = np.nansum(np.abs(x - y), axis=2) / n
+                elif m == 'R':
+                    chunk_results[m] = corr
+                elif m == 'NSE':
+                    chunk_results[m] = 1 - mse / var_y
+                elif m == 'KGE':
+                    alpha = np.sqrt(var_x / var_y)
+                    beta = mean_x / mean_y
+                    chunk_results[m] = 1 - np.sqrt((corr - 1) ** 2 + (alpha - 1) ** 2 + (beta - 1) ** 2)
+                elif m == 'anomaly_R':
+                    ax = x - np.asarray(X_clim[s], dtype=np.float64)
+                    ay = y - np.asarray(Y_clim[s], dtype=np.float64)
+                    anomaly_nan = np.isnan(ax) | np.isnan(ay)
+                    ax[anomaly_nan] = np.nan
+                    ay[anomaly_nan] = np.nan
+                    chunk_results[m] = correlation(ax, ay)
+                elif m == 'spearman':
+                    # Invalid values are ranked last (as inf), so valid values get the average ranks 1..n
+                    rank_x = stats.rankdata(np.where(valid, x, np.inf), method='average', axis=2)
+                    rank_y = stats.rankdata(np.where(valid, y, np.inf), method='average', axis=2)
+                    rank_x[~valid] = np.nan
+                    rank_y[~valid] = np.nan
+                    chunk_results[m] = correlation(rank_x, rank_y)
+
+        for m in metric_list:
+            results[m][s] = chunk_results[m]
+
+    return results
@@ -0,0 +1,79 @@
+# Benchmark of HydroAI.Vectorization.metrics against naive NumPy implementations (repeated np.nanmean calls).
+# Both are run on the same synthetic (lat, lon, time) cubes and the results are compared.
+import sys
+import platform
+import time
+import numpy as np
+from scipy import stats
+
+# Check the platform to set file paths
+if platform.system() == 'Darwin':  # macOS
+    base_FP = '/Users/hyunglokkim/Insync/hkim@geol.sc.edu/Google_Drive'
+else:
+    base_FP = '/data'
+
+# Add Python modules path and import
+sys.path.append(base_FP + '/python_modules')
+import HydroAI.Vectorization as hVec
+
+def naive_metrics(X, Y):
+    nan_mask = np.isnan(X) | np.isnan(Y)
+    X = np.where(nan_mask, np.nan, X)
+    Y = np.where(nan_mask, np.nan, Y)
+
+    results = {}
+    results['bias'] = np.nanmean(X - Y, axis=2)
+    results['RMSE'] = np.sqrt(np.nanmean((X - Y) ** 2, axis=2))
+    results['ubRMSE'] = np.sqrt(np.nanmean(((X - np.nanmean(X, axis=2, keepdims=True)) - (Y - np.nanmean(Y, axis=2, keepdims=True))) ** 2, axis=2))
+    results['MAE'] = np.nanmean(np.abs(X - Y), axis=2)
+    results['R'] = hVec.correlation(X, Y)
+    results['NSE'] = 1 - np.nansum((X - Y) ** 2, axis=2) / np.nansum((Y - np.nanmean(Y, axis=2, keepdims=True)) ** 2, axis=2)
+    alpha = np.nanstd(X, axis=2) / np.nanstd(Y, axis=2)
+    beta = np.nanmean(X, axis=2) / np.nanmean(Y, axis=2)
+    results['KGE'] = 1 - np.sqrt((results['R'] - 1) ** 2 + (alpha - 1) ** 2 + (beta - 1) ** 2)
+    return results
+
+def naive_spearman(X, Y):
+    rho = np.full(X.shape[:2], np.nan)
+    for i in range(X.shape[0]):
+        for j in range(X.shape[1]):
+            valid = ~np.isnan(X[i, j]) & ~np.isnan(Y[i, j])
+            if np.sum(valid) > 2:
+                rho[i, j] = stats.spearmanr(X[i, j, valid], Y[i, j, valid])[0]
+    return rho
+
+if __name__ == '__main__':
+    rng = np.random.default_rng(0)
+    shape = (200, 300, 366)
+    truth = rng.normal(0.25, 0.08, shape)
+    X = (truth + rng.normal(0.02, 0.04, shape)).astype(np.float32)
+    Y = (truth + rng.normal(0, 0.03, shape)).astype(np.float32)
+    X[rng.random(shape) < 0.3] = np.nan
+    Y[rng.random(shape) < 0.2] = np.nan
+
+    metric_list = ['bias', 'RMSE', 'ubRMSE', 'MAE', 'R', 'NSE', 'KGE']
+
+    start_time = time.time()
+    naive = naive_metrics(X.astype(np.float64), Y.astype(np.float64))
+    naive_time = time.time() - start_time
+
+    start_time = time.time()
+    fused = hVec.metrics(X, Y, metric_list, chunk_size=50)
+    fused_time = time.time() - start_time
+
+    print(f"Naive NumPy: {naive_time:.2f} s, Vectorization.metrics: {fused_time:.2f} s ({naive_time / fused_time:.1f}x)")
+    for m in metric_list:
+        print(f"{m:>8}: max abs difference {np.nanmax(np.abs(naive[m] - fused[m])):.2e}")
+
+    # Spearman rank correlation on a subset (the naive version loops over pixels)
+    sub = (slice(0, 20), slice(0, 30))
+    start_time = time.time()
+    rho_naive = naive_spearman(X[sub].astype(np.float64), Y[sub].astype(np.float64))
+    naive_time = time.time() - start_time
+
+    start_time = time.time()
+    rho = hVec.metrics(X[sub], Y[sub], ['spearman'])['spearman']
+    fused_time = time.time() - start_time
+
+    print(f"Spearman - naive: {naive_time:.2f} s, Vectorization.metrics: {fused_time:.2f} s ({naive_time / fused_time:.1f}x)")
+    print(f"spearman: max abs difference {np.nanmax(np.abs(rho_naive - rho)):.2e}")
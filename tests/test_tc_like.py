@@ -0,0 +1,47 @@
+import numpy as np
+
+import HydroAI.TC_like as hTC
+
+
+def synthetic_triplet(seed=0, shape=(6, 7, 400)):
+    rng = np.random.default_rng(seed)
+    truth = rng.normal(0.25, 0.08, shape)
+    params = [(0, 1, 0.03), (0.05, 0.8, 0.05), (-0.02, 1.2, 0.04)]
+    datasets = [a + b * truth + rng.normal(0, s, shape) for a, b, s in params]
+    mask = rng.random(shape) < 0.3
+    for data in datasets:
+        data[mask] = np.nan
+    return datasets
+
+
+def test_ec_matches_tca_vec_snr_r_fmse():
+    datasets = synthetic_triplet()
+    VAR_err, SNR, SNRdb, R, fMSE, _ = hTC.EC(datasets, names=list('xyz'))
+    ref = hTC.TCA_vec(*[d.copy() for d in datasets])
+
+    for ec, tca in ((SNR, ref[1]), (SNRdb, ref[2]), (R, ref[3]), (fMSE, ref[4])):
+        for name in 'xyz':
+            np.testing.assert_allclose(ec[name], tca[name], rtol=1e-10)
+    np.testing.assert_allclose(VAR_err['x'], ref[0]['x'], rtol=1e-10)
+
+
+def test_ec_var_err_uses_centered_scaling():
+    # TCA_vec rescales Y and Z with uncentered moments, EC with covariances: VAR_err of y and z differ by the
+    # squared ratio of the two scaling factors.
+    datasets = synthetic_triplet()
+    VAR_err = hTC.EC(datasets, names=list('xyz'))[0]
+    ref = hTC.TCA_vec(*[d.copy() for d in datasets])
+
+    X, Y, Z = datasets
+    valid = ~(np.isnan(X) | np.isnan(Y) | np.isnan(Z))
+    X, Y, Z = (np.where(valid, d, np.nan) for d in (X, Y, Z))
+    Xc, Yc, Zc = (d - np.nanmean(d, axis=2, keepdims=True) for d in (X, Y, Z))
+
+    c2_centered = np.nansum(Xc * Zc, axis=2) / np.nansum(Yc * Zc, axis=2)
+    c3_centered = np.nansum(Xc * Yc, axis=2) / np.nansum(Zc * Yc, axis=2)
+    c2_uncentered = np.nansum(X * Z, axis=2) / np.nansum(Y * Z, axis=2)
+    c3_uncentered = np.nansum(X * Y, axis=2) / np.nansum(Z * Y, axis=2)
+
+    np.testing.assert_allclose(VAR_err['y'], ref[0]['y'] * (c2_centered / c2_uncentered) ** 2, rtol=1e-8)
+    np.testing.assert_allclose(VAR_err['z'], ref[0]['z'] * (c3_centered / c3_uncentered) ** 2, rtol=1e-8)
+    assert not np.allclose(VAR_err['y'], ref[0]['y'], rtol=1e-6)